@@ -19,6 +19,20 @@ const float wheelCircumference = 12 * PI; // In inches
 const int maxThrottle = 35;
 const int minThrottle = 0;
 int lastButtonState = HIGH; // Last state of the button
+//Binary framing, keep in sync with Pi/framing.py
+const uint8_t protocolVersion = 2;
+const uint8_t frameArduinoState = 0x02;
+const uint8_t frameStatus = 0x7F;
+bool binaryMode = false; // Set by the "binary" command
+// Payload of an Arduino state frame, little endian like the AVR itself
+struct __attribute__((packed)) StateFrame
+{
+  float throttle;
+  float brake;
+  float speed;
+  uint32_t sampleTime; // Capture time in micros(), mapped to Pi time by jerial.ClockSync
+};
+uint8_t frameSeq = 0;
 
 // Reads data from a given analog pin and returns it as an angle (-180, 180).
 float readPedal(uint8_t analogPin)
@@ -38,6 +52,85 @@ float readPedal(uint8_t analogPin)
   return angle;
 }
 
+// CRC-16/CCITT-FALSE over the given bytes
+uint16_t crc16(const uint8_t *data, size_t length)
+{
+  uint16_t crc = 0xFFFF;
+  for(size_t i = 0; i < length; i++)
+  {
+    crc ^= (uint16_t)data[i] << 8;
+    for(uint8_t bit = 0; bit < 8; bit++)
+    {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+// COBS encodes a frame shorter than 254 bytes, returns the encoded length
+size_t cobsEncode(const uint8_t *data, size_t length, uint8_t *out)
+{
+  size_t codeIndex = 0;
+  size_t index = 1;
+  uint8_t code = 1;
+  for(size_t i = 0; i < length; i++)
+  {
+    if(data[i] == 0)
+    {
+      out[codeIndex] = code;
+      codeIndex = index++;
+      code = 1;
+    }
+    else
+    {
+      out[index++] = data[i];
+      code++;
+    }
+  }
+  out[codeIndex] = code;
+  return index;
+}
+
+// Writes type | seq | payload | crc16 as a zero delimited COBS frame
+void writeFrame(uint8_t type, const uint8_t *payload, size_t length)
+{
+  uint8_t raw[48];
+  uint8_t encoded[52];
+  raw[0] = type;
+  raw[1] = frameSeq++;
+  memcpy(raw + 2, payload, length);
+  uint16_t crc = crc16(raw, length + 2);
+  raw[length + 2] = crc & 0xFF;
+  raw[length + 3] = crc >> 8;
+  size_t encodedLength = cobsEncode(raw, length + 4, encoded);
+  Serial.write(encoded, encodedLength);
+  Serial.write((uint8_t)0);
+}
+
+// Sends a short reply in the currently negotiated format
+void sendReply(JsonDocument &reply)
+{
+  if(binaryMode)
+  {
+    char text[48];
+    size_t length = serializeJson(reply, text, sizeof(text));
+    writeFrame(frameStatus, (const uint8_t *)text, length);
+  }
+  else
+  {
+    serializeJson(reply, Serial);
+    Serial.println();
+  }
+}
+
+// Sends a status message in the currently negotiated format
+void sendStatus(const char *status)
+{
+  JsonDocument reply;
+  reply["status"] = status;
+  sendReply(reply);
+}
+
 void setup() 
 {
   Serial.begin(115200);
@@ -81,6 +174,7 @@ float readSpeed()
 
 void loop() 
 {
+  unsigned long sampleTime = micros();
   float throttleAngle = readPedal(analogThrottle);
   float breakAngle = readPedal(analogBreak);
   float speed = readSpeed();
@@ -92,7 +186,12 @@ void loop()
 
     deserializeJson(message, Serial.readStringUntil('\n'));  // Deserialize the incoming JSON
 
-    if(message["command"] == "poll")
+    if(message["command"] == "poll" && binaryMode)
+    {
+      StateFrame state = {throttleAngle, breakAngle, speed, sampleTime};
+      writeFrame(frameArduinoState, (const uint8_t *)&state, sizeof(state));
+    }
+    else if(message["command"] == "poll")
     {
       // Create a JSON document
       JsonDocument data;
@@ -101,11 +200,37 @@ void loop()
       data["throttle"] = throttleAngle;
       data["break"] = breakAngle; // If break angle is max then set throttle to 0 in main code? Cant do burn out tho :(
       data["speed"] = speed;
+      data["t"] = sampleTime;
 
       // Serialize the document to a string and send it over Serial
       serializeJson(data, Serial);
       Serial.println();
     }
+    else if(message["command"] == "sync")
+    {
+      // Clock sync ping, answered straight away so the round trip stays short
+      JsonDocument reply;
+      reply["status"] = "sync";
+      reply["t"] = micros();
+      reply["id"] = message["id"];
+      sendReply(reply);
+    }
+    else if(message["command"] == "binary")
+    {
+      // Acknowledge in JSON, everything after this is framed
+      JsonDocument reply;
+      reply["status"] = "binary";
+      reply["version"] = protocolVersion;
+      serializeJson(reply, Serial);
+      Serial.println();
+      binaryMode = true;
+    }
+    else if(message["command"] == "json")
+    {
+      // Acknowledge inside a frame, everything after this is JSON again
+      sendStatus("json");
+      binaryMode = false;
+    }
   }
 }
 
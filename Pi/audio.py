@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Engine sound process. Reads the pedals from the telemetry bus and drives EngineAudioPlayer.
+Normally started by supervisor.py, run from the Pi directory.
+"""
+from startup import profile, ENABLED as PROFILE_STARTUP
+import argparse
+import signal
+import time
+from bus import TelemetryReader, DEFAULT_NAME
+from supervisor import lock_memory
+
+MIN_SPEED = 0.25
+MAX_SPEED = 3.0
+CHUNK_DURATION = 0.05
+IDLE_RPM = 4000
+MAX_RPM = 18000
+RPM_RISE_RATE = 12000  # RPM per second the granular engine revs up at most
+RPM_FALL_RATE = 8000  # And down
+# Pedal travel (fraction) the throttle must move against the current direction to switch
+# recordings, a few readPedal steps of about 0.35 degrees so sensor noise never does
+DIRECTION_DEADBAND = 0.03
+# Most samples --mlock may pin. A whole pitch bank is over 30 times the recording, far too
+# much for the Pi, so only the variants around idle are locked and the rest page in as played
+MLOCK_LIMIT = 64 * 1024 * 1024
+
+def connect(name, retry=0.5) -> TelemetryReader:
+    '''Waits for the serial process to create the bus.'''
+    while True:
+        try:
+            return TelemetryReader(name)
+        except FileNotFoundError:
+            time.sleep(retry)
+
+def throttle_speed(fraction) -> float:
+    '''Playback speed for a pedal position, idle speed with the pedal released.'''
+    return MIN_SPEED + fraction * (MAX_SPEED - MIN_SPEED)
+
+def throttle_rpm(fraction) -> float:
+    '''Target engine RPM for a pedal position.'''
+    return IDLE_RPM + fraction * (MAX_RPM - IDLE_RPM)
+
+def approach_rpm(rpm, target, elapsed) -> float:
+    '''Moves rpm towards target at most as fast as the engine could rev.'''
+    if target > rpm:
+        return min(target, rpm + RPM_RISE_RATE * elapsed)
+    return max(target, rpm - RPM_FALL_RATE * elapsed)
+
+def run_granular(player, reader):
+    '''RPM driven loop: any RPM can be held, nothing ever plays to the end of a file.'''
+    rpm = IDLE_RPM
+    last = time.monotonic()
+    while player.running:
+        now = time.monotonic()
+        rpm = approach_rpm(rpm, throttle_rpm(reader.read().throttle_fraction), now - last)
+        last = now
+        status = player.play_rpm(rpm, CHUNK_DURATION)
+        if status['error']:
+            print(f"Error: {status['error']}")
+            break
+        if status['dropped']:
+            # The ring only holds a few callback blocks, wait one of them
+            time.sleep(player.block_duration)
+        else:
+            profile.mark("first sound")
+
+def run_speed(player, reader):
+    '''Speed driven loop: the pedal sets the playback speed of the recordings.'''
+    position = 0.0
+    rev_up = True
+    extreme = 0.0  # Furthest throttle reached in the current direction
+    while player.running:
+        throttle = reader.read().throttle_fraction
+        # Pressing the pedal plays the accelerating recording, releasing it the decelerating one
+        if rev_up:
+            extreme = max(extreme, throttle)
+        else:
+            extreme = min(extreme, throttle)
+        if abs(throttle - extreme) > DIRECTION_DEADBAND:
+            # Carry on from the same RPM in the other recording, from its start without timestamps
+            matching = player.matching_position(rev_up, position)
+            position = matching if matching is not None else 0.0
+            rev_up = not rev_up
+            extreme = throttle
+        status = player.play_chunk(rev_up=rev_up, start_time=position, speed=throttle_speed(throttle),
+                                   duration=CHUNK_DURATION)
+        if status['error']:
+            print(f"Error: {status['error']}")
+            break
+        if status['dropped']:
+            # The output is full, come back when a block has been played
+            time.sleep(player.block_duration)
+        else:
+            position = status['position']
+            profile.mark("first sound")
+        if status['done']:
+            position = 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Engine sound driven by the telemetry bus.")
+    parser.add_argument("--rev-up", default="engine/audio/accel.wav", help="Accelerating recording")
+    parser.add_argument("--rev-down", default="engine/audio/decel.wav", help="Decelerating recording")
+    parser.add_argument("--bank", default="engine/audio/bank",
+                        help="Directory of pre-rendered speed variants, rendered on first start")
+    parser.add_argument("--no-bank", action="store_true", help="Resample in real time instead of using the bank")
+    parser.add_argument("--cache", default="engine/audio/cache", help="Directory of decoded recordings")
+    parser.add_argument("--no-cache", action="store_true", help="Decode the recordings on every start")
+    parser.add_argument("--granular", action="store_true",
+                        help="Synthesise the engine from grains at the throttle's RPM instead of varying the speed")
+    parser.add_argument("--timestamps", default="engine/audio/timestamps.json",
+                        help="RPM to recording position table, used to switch recordings at the same RPM")
+    parser.add_argument("--bus", default=DEFAULT_NAME, help="Telemetry bus name")
+    parser.add_argument("--mlock", action="store_true", help="Lock the loaded samples into RAM")
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # Imported here so a missing sound device does not break importing this module
+    with profile.phase("imports"):
+        from engine.player import EngineAudioPlayer
+    with profile.phase("audio init"):
+        player = EngineAudioPlayer(args.rev_up, args.rev_down, CHUNK_DURATION,
+                                   bank_dir=None if args.no_bank or args.granular else args.bank,
+                                   timestamps_path=args.timestamps, granular=args.granular,
+                                   cache_dir=None if args.no_cache else args.cache)
+    if args.mlock:
+        # The arrays actually played, with a bank the decoded recordings are not among them
+        lock_memory(*player.sample_arrays(throttle_speed(0.0)), limit=MLOCK_LIMIT)
+    with profile.phase("wait for bus"):
+        reader = connect(args.bus)
+
+    try:
+        if args.granular:
+            run_granular(player, reader)
+        else:
+            run_speed(player, reader)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        player.stop()
+        reader.close()
+        print(f"Audio output: {player.stats()}")
+        if PROFILE_STARTUP:
+            profile.print_report("audio startup")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Compares the message decoders on typical firmware output.
+Run from the Pi directory: python bench_decoders.py [iterations]
+"""
+import json
+import sys
+import timeit
+from jerial import MessageDecoder, DEFAULT_SCHEMAS
+
+LINES = {
+    "pico": b'{"steer": 123.456789, "button": false, "knob": {"count": -12, "switch": true}}\r',
+    "arduino": b'{"throttle":17.3216,"break":0,"speed":12.48}\r',
+    "status": b'{"status": "tared"}\r',
+    "unknown": b'{"status": "streaming", "rate": 200}\r',
+}
+
+def decoders() -> dict:
+    result = {
+        "json.loads": lambda data: json.loads(bytes(data)),
+        "schemas + json": MessageDecoder(DEFAULT_SCHEMAS, json.loads).decode,
+    }
+    try:
+        import orjson
+        result["orjson.loads"] = lambda data: orjson.loads(bytes(data))
+        result["schemas + orjson"] = MessageDecoder(DEFAULT_SCHEMAS, orjson.loads).decode
+        result["orjson only"] = MessageDecoder((), orjson.loads).decode
+    except ImportError:
+        print("orjson not installed, skipping accelerated backend")
+    return result
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    candidates = decoders()
+    print(f"{'decoder':<20}" + "".join(f"{name:>12}" for name in LINES) + "   (us per line)")
+    for name, decode in candidates.items():
+        row = f"{name:<20}"
+        for line in LINES.values():
+            seconds = timeit.timeit(lambda: decode(line), number=iterations)
+            row += f"{seconds / iterations * 1e6:>12.3f}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+'''
+Shared memory telemetry bus between the serial, audio and UI processes.
+
+A single writer (the serial hub) publishes the latest fused vehicle state, any number
+of readers copy it out without locks or pickling. Consistency comes from a seqlock:
+the writer makes the sequence odd, writes the record and makes it even again, a reader
+retries whenever the sequence was odd or changed while it was copying.
+
+Every writer stamps the header with a random epoch. A restarted writer creates a new
+segment under the same name (or rewrites a stale one), readers notice the sequence has
+stopped moving, look the name up again and move over when the epoch differs.
+
+Segment layout:
+    header: magic (4 bytes) | version (u32) | record size (u32) | writer epoch (u32)
+    sequence (u64)
+    record (STATE)
+All numbers are little endian. Times are time.monotonic() of the writer, which is the
+same clock in every process on the Pi, NaN until the device has sent anything.
+'''
+import math
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from records import Record
+
+DEFAULT_NAME = "f1os-telemetry"
+MAGIC = b"F1TB"
+VERSION = 2
+HEADER = struct.Struct("<4sIII")
+EPOCH = struct.Struct("<I")
+EPOCH_OFFSET = HEADER.size - EPOCH.size
+SEQUENCE = struct.Struct("<Q")
+# time, pico time, arduino time, steer, throttle, brake, speed, knob count, button, knob switch
+STATE = struct.Struct("<dddffffi??2x")
+SEQUENCE_OFFSET = HEADER.size
+STATE_OFFSET = SEQUENCE_OFFSET + SEQUENCE.size
+SEGMENT_SIZE = STATE_OFFSET + STATE.size
+THROTTLE_MAX = 35.0  # maxThrottle in sensor.ino, degrees
+
+class TelemetryState(Record):
+    '''One consistent snapshot of the bus. seq grows by one per publish.'''
+    __slots__ = ("time", "pico_time", "arduino_time", "steer", "throttle", "brake", "speed",
+                 "knob_count", "button", "knob_switch", "seq")
+    KEYS = ("time", "pico_time", "arduino_time", "steer", "throttle", "break", "speed",
+            "knob_count", "button", "knob_switch")
+    ATTRIBUTES = {"break": "brake"}
+    OPTIONAL = ()
+
+    def __init__(self, time=math.nan, pico_time=math.nan, arduino_time=math.nan, steer=0.0, throttle=0.0,
+                 brake=0.0, speed=0.0, knob_count=0, button=False, knob_switch=False, seq=0):
+        self.time = time
+        self.pico_time = pico_time
+        self.arduino_time = arduino_time
+        self.steer = steer
+        self.throttle = throttle
+        self.brake = brake
+        self.speed = speed
+        self.knob_count = knob_count
+        self.button = button
+        self.knob_switch = knob_switch
+        self.seq = seq
+
+    @property
+    def throttle_fraction(self) -> float:
+        '''Pedal travel from 0 (released) to 1 (floored).'''
+        return min(max(self.throttle / THROTTLE_MAX, 0.0), 1.0)
+
+    def pack(self) -> tuple:
+        return (self.time, self.pico_time, self.arduino_time, self.steer, self.throttle, self.brake, self.speed,
+                self.knob_count, self.button, self.knob_switch)
+
+def _attach(name):
+    '''Opens an existing segment without handing it to the resource tracker,
+    which would otherwise unlink it when the reading process exits.'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+class TelemetryWriter:
+    '''Owns the segment and publishes into it. There must only ever be one writer.'''
+    def __init__(self, name=DEFAULT_NAME):
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=SEGMENT_SIZE)
+        except FileExistsError:
+            # Left behind by a writer that crashed, the layout is rewritten below
+            self.memory = _attach(name)
+        self.name = name
+        self.buffer = self.memory.buf
+        # Zero is never used, a segment whose header is not written yet reads as epoch 0
+        self.epoch = int.from_bytes(os.urandom(4), "little") or 1
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, STATE.size, self.epoch)
+        self.seq = 0
+        self.state = TelemetryState()
+        self.publish()
+
+    def publish(self) -> None:
+        '''Writes the current state. Readers never see a half written record.'''
+        self.state.time = time.monotonic()
+        # Odd while writing
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, 2 * self.seq + 1)
+        STATE.pack_into(self.buffer, STATE_OFFSET, *self.state.pack())
+        self.seq += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, 2 * self.seq)
+        self.state.seq = self.seq
+
+    def update(self, name, timestamp, message) -> None:
+        '''Folds a device message into the state and publishes it, fits SerialHub.subscribe().'''
+        if "status" in message:
+            return
+        state = self.state
+        if name == "pico":
+            knob = message["knob"]
+            state.pico_time = timestamp
+            state.steer = message["steer"]
+            state.button = message["button"]
+            state.knob_count = knob["count"]
+            state.knob_switch = knob["switch"]
+        elif name == "arduino":
+            state.arduino_time = timestamp
+            state.throttle = message["throttle"]
+            state.brake = message["break"]
+            state.speed = message["speed"]
+        else:
+            return
+        self.publish()
+
+    def close(self, unlink=True) -> None:
+        self.buffer = None
+        self.memory.close()
+        if unlink:
+            # Forked readers on older Pythons unregister the name from the tracker they share with us
+            resource_tracker.register(self.memory._name, "shared_memory")
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+class TelemetryReader:
+    '''Lock free view of a segment created by a TelemetryWriter, in this or another process.\n
+    Follows a restarted writer: once the sequence has not moved for check_interval seconds
+    the name is looked up again, see reattach().'''
+    def __init__(self, name=DEFAULT_NAME, retries=1000, check_interval=0.5):
+        self.name = name
+        self.retries = retries
+        self.check_interval = check_interval
+        self.collisions = 0  # Reads repeated because the writer was mid update
+        self.reattaches = 0  # Times a restarted writer was followed to its new segment
+        memory = _attach(name)
+        if not self._open(memory):
+            memory.close()
+            raise ValueError(f"Incompatible telemetry segment: {name}")
+
+    def _open(self, memory) -> bool:
+        magic, version, size, epoch = HEADER.unpack_from(memory.buf, 0)
+        if magic != MAGIC or version != VERSION or size != STATE.size:
+            return False
+        self.memory = memory
+        self.buffer = memory.buf
+        self.epoch = epoch
+        self.last = TelemetryState()
+        self.seen_seq = None
+        self.seen_time = time.monotonic()
+        return True
+
+    def reattach(self) -> bool:
+        '''Moves to the segment now registered under the name if a different writer owns it.\n
+        Returns True if it moved. A segment that is gone or still being set up is left for later.'''
+        try:
+            memory = _attach(self.name)
+        except FileNotFoundError:
+            return False  # The writer has not been restarted yet
+        if EPOCH.unpack_from(memory.buf, EPOCH_OFFSET)[0] == self.epoch or not self._replace(memory):
+            memory.close()
+            return False
+        self.reattaches += 1
+        return True
+
+    def _replace(self, memory) -> bool:
+        old = self.memory
+        self.buffer = None
+        if not self._open(memory):
+            self.buffer = old.buf
+            return False
+        old.close()
+        return True
+
+    def _check_writer(self) -> None:
+        epoch = EPOCH.unpack_from(self.buffer, EPOCH_OFFSET)[0]
+        if epoch != self.epoch:
+            # A new writer took over this segment in place, its sequence starts from zero again
+            self.epoch = epoch
+            self.last = TelemetryState()
+        seq = SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0]
+        now = time.monotonic()
+        if seq != self.seen_seq:
+            self.seen_seq = seq
+            self.seen_time = now
+        elif now - self.seen_time >= self.check_interval:
+            # Nothing published for a while, the writer may be publishing into a new segment
+            self.seen_time = now
+            self.reattach()
+
+    def sequence(self) -> int:
+        '''Number of publishes so far, cheap enough to check every frame.'''
+        return SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0] >> 1
+
+    def changed(self) -> bool:
+        self._check_writer()
+        return self.sequence() != self.last.seq
+
+    def read(self) -> TelemetryState:
+        '''Returns the latest consistent state.\n
+        If the writer keeps colliding for retries attempts the previous state is returned.'''
+        self._check_writer()
+        buffer = self.buffer
+        for _ in range(self.retries):
+            before = SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0]
+            if before & 1 == 0:
+                values = STATE.unpack_from(buffer, STATE_OFFSET)
+                if SEQUENCE.unpack_from(buffer, SEQUENCE_OFFSET)[0] == before:
+                    if before >> 1 != self.last.seq:
+                        self.last = TelemetryState(*values, seq=before >> 1)
+                    return self.last
+            self.collisions += 1
+        return self.last
+
+    def close(self) -> None:
+        self.buffer = None
+        self.memory.close()
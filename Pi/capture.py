@@ -0,0 +1,152 @@
+'''
+Wire level capture and replay for serial links.
+
+Capture file layout:
+    header: magic (6 bytes) | start time (f64)
+    records: timestamp (f64) | length (u32) | raw bytes
+All numbers are little endian, timestamps are time.monotonic() at the moment the chunk was read.
+'''
+import mmap
+import struct
+import time
+
+MAGIC = b"F1CAP\x01"
+HEADER = struct.Struct("<6sd")
+RECORD = struct.Struct("<dI")
+
+class CaptureWriter:
+    '''Appends raw chunks with their receive time to a capture file.'''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, time.monotonic()))
+        self.chunks = 0
+        self.bytes = 0
+
+    def write(self, timestamp, data):
+        self.file.write(RECORD.pack(timestamp, len(data)))
+        self.file.write(data)
+        self.chunks += 1
+        self.bytes += len(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+class CaptureFile:
+    '''Memory maps a capture so multi-hour recordings are never loaded into RAM.'''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.start_time = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a capture file: {path}")
+
+    def records(self, offset=HEADER.size):
+        '''Yields (timestamp, memoryview) for every chunk from offset onwards.\n
+        The views point into the mapping, copy them if they must outlive the file.'''
+        view = memoryview(self.map)
+        size = len(self.map)
+        try:
+            while offset + RECORD.size <= size:
+                timestamp, length = RECORD.unpack_from(self.map, offset)
+                offset += RECORD.size
+                if offset + length > size:
+                    break  # Truncated final record, the capture was cut short
+                yield timestamp, view[offset:offset + length]
+                offset += length
+        finally:
+            view.release()
+
+    def close(self):
+        if getattr(self, "map", None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+class ReplaySource:
+    '''Serial port stand in that plays a capture back, usable as the port of a JSONSerialReader.\n
+    speed scales the original timing (2.0 = twice as fast), None plays as fast as possible.\n
+    Commands written to it are discarded.'''
+    BUFFER_SIZE = 65536  # Like the driver's input buffer, chunks stay in the mapping until there is room
+
+    def __init__(self, path, speed=1.0, timeout=0.1):
+        self.capture = CaptureFile(path)
+        self.speed = speed
+        self.timeout = timeout
+        self.records = self.capture.records()
+        self.next_record = next(self.records, None)
+        self.first_time = self.next_record[0] if self.next_record else 0.0
+        self.started = None
+        self.pending = bytearray()
+        self.finished = self.next_record is None
+
+    def _due(self, record):
+        if not self.speed:
+            return True
+        return time.monotonic() - self.started >= (record[0] - self.first_time) / self.speed
+
+    def _advance(self):
+        '''Moves chunks whose time has come into the pending buffer, up to BUFFER_SIZE bytes.'''
+        if self.started is None:
+            self.started = time.monotonic()
+        while (self.next_record is not None and len(self.pending) < self.BUFFER_SIZE
+               and self._due(self.next_record)):
+            self.pending += self.next_record[1]
+            self.next_record = next(self.records, None)
+        if self.next_record is None:
+            self.finished = True
+
+    @property
+    def in_waiting(self):
+        self._advance()
+        return len(self.pending)
+
+    def read(self, size=1):
+        self._advance()
+        if not self.pending and self.next_record is not None:
+            # Behave like a port with a read timeout, wait for the next chunk
+            wait = (self.next_record[0] - self.first_time) / self.speed - (time.monotonic() - self.started)
+            time.sleep(max(0.0, min(wait, self.timeout)))
+            self._advance()
+        elif not self.pending:
+            time.sleep(self.timeout)
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        # Views into the mapping must be gone before it can be closed
+        self.next_record = None
+        self.records.close()
+        self.capture.close()
+
+def replay(path, reader):
+    '''Feeds every chunk of a capture into reader with its original timestamp, as fast as possible.\n
+    The result is deterministic, which makes it the right tool for profiling parsing.'''
+    capture = CaptureFile(path)
+    records = capture.records()
+    try:
+        for timestamp, data in records:
+            reader.feed(data, timestamp)
+            data.release()
+    finally:
+        records.close()
+        capture.close()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Pseudo-terminal emulators for the Pico and Arduino firmware.
+Lets the serial pipeline be run and load tested without hardware.
+
+Example:
+    python emulator.py pico arduino --link /tmp/pico /tmp/arduino --stream 1000
+    (then open JSONSerialReader("/tmp/pico") as usual)
+"""
+import abc
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+from framing import (encode_frame, PICO_STATE, ARDUINO_STATE, FRAME_PICO_STATE, FRAME_ARDUINO_STATE,
+                     FRAME_STATUS, FRAME_REPLY, REPLY_ID, PROTOCOL_VERSION)
+
+class SyntheticSignals:
+    '''Smooth, repeatable sensor values derived from the elapsed time.'''
+    def pico(self, t) -> dict:
+        return {
+            'steer': 30.0 * math.sin(2 * math.pi * 0.25 * t),
+            'button': int(t) % 5 == 0,
+            'knob': {
+                "count": int(t * 2) % 40 - 20,
+                "switch": int(t) % 7 == 0
+            }
+        }
+
+    def arduino(self, t) -> dict:
+        throttle = 35.0 * (0.5 + 0.5 * math.sin(2 * math.pi * 0.2 * t))
+        brake = max(0.0, 35.0 * math.sin(2 * math.pi * 0.1 * t))
+        return {"throttle": throttle, "break": brake, "speed": throttle * 1.5}
+
+class ReplaySignals:
+    '''Replays state messages from a file with one JSON object per line, looping at the end.'''
+    def __init__(self, path):
+        with open(path, "r") as f:
+            self.messages = [json.loads(line) for line in f if line.strip()]
+        if not self.messages:
+            raise ValueError(f"No messages in replay file: {path}")
+        self.index = 0
+
+    def _next(self) -> dict:
+        message = self.messages[self.index]
+        self.index = (self.index + 1) % len(self.messages)
+        return message
+
+    def pico(self, t) -> dict:
+        return self._next()
+
+    def arduino(self, t) -> dict:
+        return self._next()
+
+class DeviceEmulator(abc.ABC):
+    '''Serves one firmware protocol on the master side of a pseudo-terminal.\n
+    latency and jitter (seconds) delay every output, corruption is the probability
+    of flipping one byte of an output message, drift (ppm) skews the device clock.'''
+    MAX_STREAM_RATE = 1000
+    TICKS_PERIOD = 1 << 32
+
+    def __init__(self, signals=None, latency=0.0, jitter=0.0, corruption=0.0, link=None, seed=None, drift=0.0):
+        self.signals = signals or SyntheticSignals()
+        self.latency = latency
+        self.jitter = jitter
+        self.corruption = corruption
+        self.random = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        # Raw mode so nothing is echoed or translated, just like a USB CDC port
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.link = link
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.port, link)
+        self.started = time.monotonic()
+        self.drift = drift
+        # Devices boot at an arbitrary point of their tick counter
+        self.ticks_origin = self.random.randrange(self.TICKS_PERIOD)
+        self.binary = False
+        self.seq = 0
+        self.stream_period = 0.0
+        self.next_stream = 0.0
+        self.outgoing = []  # Heap of (due time, order, bytes)
+        self.partial = False  # The head of outgoing is the unwritten tail of a message
+        self.order = 0
+        self.last_due = 0.0
+        self.rx_buffer = bytearray()
+        self.commands = 0
+        self.sent = 0
+        self.overruns = 0  # Messages dropped because the reader was not draining the port
+        self.running = False
+        self.thread = None
+
+    # Protocol, implemented by subclasses
+    @abc.abstractmethod
+    def state(self) -> dict:
+        ...
+
+    @abc.abstractmethod
+    def encode_state(self, state, request_id=None) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def handle_command(self, command: dict) -> None:
+        ...
+
+    def ticks(self) -> int:
+        '''Device microsecond counter, wrapping like the firmware clock.'''
+        elapsed = (time.monotonic() - self.started) * (1.0 + self.drift * 1e-6)
+        return (self.ticks_origin + int(elapsed * 1e6)) % self.TICKS_PERIOD
+
+    # Output helpers
+    def send_json(self, message, request_id=None) -> None:
+        if request_id is not None:
+            message["id"] = request_id
+        self.queue(json.dumps(message).encode() + b"\r\n")
+
+    def send_status(self, message, request_id=None) -> None:
+        if request_id is not None:
+            message["id"] = request_id
+        if self.binary:
+            self.queue(self.frame(FRAME_STATUS, json.dumps(message).encode()))
+        else:
+            self.send_json(message)
+
+    def send_state(self, request_id=None) -> None:
+        state = dict(self.state())
+        state["t"] = self.ticks()
+        if self.binary:
+            self.queue(self.encode_state(state, request_id))
+        else:
+            if request_id is not None:
+                state["id"] = request_id
+            self.send_json(state)
+
+    def reply_frame(self, frame_type, payload, request_id) -> bytes:
+        if request_id is None:
+            return self.frame(frame_type, payload)
+        return self.frame(frame_type | FRAME_REPLY, REPLY_ID.pack(request_id) + payload)
+
+    def frame(self, frame_type, payload) -> bytes:
+        data = encode_frame(frame_type, self.seq, payload)
+        self.seq = (self.seq + 1) & 0xFF
+        return data
+
+    def queue(self, data) -> None:
+        if self.corruption and self.random.random() < self.corruption:
+            data = bytearray(data)
+            data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+            data = bytes(data)
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        # A serial link never reorders, so jitter can only push messages later
+        self.last_due = max(self.last_due, time.monotonic() + delay)
+        heapq.heappush(self.outgoing, (self.last_due, self.order, data))
+        self.order += 1
+
+    def start_stream(self, rate) -> None:
+        self.stream_period = 1.0 / rate
+        self.next_stream = time.monotonic()
+
+    # Serving loop
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def serve(self) -> None:
+        while self.running:
+            now = time.monotonic()
+            deadline = now + 0.1
+            if self.stream_period:
+                deadline = min(deadline, self.next_stream)
+            if self.outgoing and not self.partial:
+                deadline = min(deadline, self.outgoing[0][0])
+            # While a message is half written, wait for the reader to make room instead of spinning
+            writers = [self.master] if self.partial else []
+            readable, _, _ = select.select([self.master], writers, [], max(0.0, deadline - now))
+            if readable:
+                self._read_commands()
+            now = time.monotonic()
+            if self.stream_period and now >= self.next_stream:
+                self.send_state()
+                self.next_stream += self.stream_period
+                if self.next_stream < now:
+                    # Skip missed deadlines like the firmware does
+                    self.next_stream = now + self.stream_period
+            self._flush(time.monotonic())
+
+    def _read_commands(self) -> None:
+        try:
+            self.rx_buffer += os.read(self.master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        while True:
+            end = self.rx_buffer.find(b"\n")
+            if end == -1:
+                break
+            line = bytes(self.rx_buffer[:end]).strip()
+            del self.rx_buffer[:end + 1]
+            if not line:
+                continue
+            try:
+                command = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(command, dict) and command.get("command") is not None:
+                self.commands += 1
+                self.handle_command(command)
+
+    def _flush(self, now) -> None:
+        while self.outgoing and self.outgoing[0][0] <= now:
+            due, order, data = self.outgoing[0]
+            try:
+                written = os.write(self.master, data)
+            except BlockingIOError:
+                if self.partial:
+                    # The rest of a started message must still go out, or the reader sees garbage
+                    return
+                heapq.heappop(self.outgoing)
+                self.overruns += 1
+                continue
+            if written < len(data):
+                # Same sort key, so replacing the head in place keeps the heap valid
+                self.outgoing[0] = (due, order, data[written:])
+                self.partial = True
+                return
+            heapq.heappop(self.outgoing)
+            self.partial = False
+            self.sent += 1
+
+class PicoEmulator(DeviceEmulator):
+    '''Speaks the Pico/main.py protocol.'''
+    TICKS_PERIOD = 1 << 30
+    def state(self) -> dict:
+        return self.signals.pico(time.monotonic() - self.started)
+
+    def encode_state(self, state, request_id=None) -> bytes:
+        knob = state["knob"]
+        payload = PICO_STATE.pack(state["steer"], state["button"], knob["count"], knob["switch"], state["t"])
+        return self.reply_frame(FRAME_PICO_STATE, payload, request_id)
+
+    def handle_command(self, command: dict) -> None:
+        name = command.get("command")
+        # Every reply echoes the request id, like process_command does
+        request_id = command.get("id")
+        if name == "reset":
+            self.send_status({'status': 'resetting'}, request_id)
+            self.binary = False
+            self.stream_period = 0.0
+            self.queue(b"Ready to receive commands\r\n")
+        elif name == "poll":
+            self.send_state(request_id)
+        elif name == "sync":
+            self.send_status({"status": "sync", "t": self.ticks()}, request_id)
+        elif name == "stream":
+            rate = max(1, min(self.MAX_STREAM_RATE, int(command.get("rate", 100))))
+            self.start_stream(rate)
+            self.send_status({"status": "streaming", "rate": rate}, request_id)
+        elif name == "stop":
+            self.stream_period = 0.0
+            self.send_status({"status": "stopped"}, request_id)
+        elif name == "save":
+            self.send_status({"status": "saved"}, request_id)
+        elif name == "tare":
+            self.send_status({"status": "tared"}, request_id)
+        elif name == "binary":
+            self.send_json({"status": "binary", "version": PROTOCOL_VERSION}, request_id)
+            self.binary = True
+        elif name == "json":
+            self.send_status({"status": "json"}, request_id)
+            self.binary = False
+        else:
+            self.send_status({"status": "unknown command"}, request_id)
+
+class ArduinoEmulator(DeviceEmulator):
+    '''Speaks the Arduino sensor.ino protocol. Unknown commands are ignored like the firmware does.'''
+    def state(self) -> dict:
+        return self.signals.arduino(time.monotonic() - self.started)
+
+    def encode_state(self, state, request_id=None) -> bytes:
+        return self.frame(FRAME_ARDUINO_STATE, ARDUINO_STATE.pack(state["throttle"], state["break"], state["speed"], state["t"]))
+
+    def handle_command(self, command: dict) -> None:
+        name = command.get("command")
+        if name == "poll":
+            self.send_state()
+        elif name == "sync":
+            self.send_status({"status": "sync", "t": self.ticks(), "id": command.get("id")})
+        elif name == "binary":
+            self.send_json({"status": "binary", "version": PROTOCOL_VERSION})
+            self.binary = True
+        elif name == "json":
+            self.send_status({"status": "json"})
+            self.binary = False
+
+EMULATORS = {"pico": PicoEmulator, "arduino": ArduinoEmulator}
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the F1-OS microcontrollers on pseudo-terminals.")
+    parser.add_argument("devices", nargs="+", choices=sorted(EMULATORS), help="Devices to emulate")
+    parser.add_argument("--link", nargs="*", default=[], help="Symlink path for each device, e.g. /tmp/pico")
+    parser.add_argument("--replay", nargs="*", default=[], help="JSON lines file of states for each device")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed output delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra output delay in seconds")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Probability of corrupting an output message")
+    parser.add_argument("--stream", type=float, default=0.0, help="Start streaming at this rate (Hz), not clamped")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for jitter and corruption")
+    parser.add_argument("--drift", type=float, default=0.0, help="Device clock drift in ppm")
+    args = parser.parse_args()
+
+    emulators = []
+    for index, name in enumerate(args.devices):
+        link = args.link[index] if index < len(args.link) else None
+        signals = ReplaySignals(args.replay[index]) if index < len(args.replay) else None
+        emulator = EMULATORS[name](signals, args.latency, args.jitter, args.corrupt, link, args.seed, args.drift)
+        if args.stream:
+            emulator.start_stream(args.stream)
+        emulator.start()
+        emulators.append(emulator)
+        print(f"{name}: {emulator.port}" + (f" -> {link}" if link else ""))
+
+    try:
+        while True:
+            time.sleep(1)
+            print(", ".join(f"{name}: {e.commands} commands, {e.sent} sent, {e.overruns} overruns"
+                            for name, e in zip(args.devices, emulators)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Pitch variant bank: every engine recording pre-rendered at a grid of playback speeds.
+
+At runtime a BankReader only mixes the two variants either side of the wanted speed,
+read with two tap interpolation at a rate within a few percent of 1, so playing at any
+speed costs a slice and a mix instead of a filter. Variants are int16 .npy files loaded
+with mmap_mode='r', only the pages actually played are ever read from disk.
+
+Build ahead of time from the Pi directory:
+    python -m engine.bank engine/audio/bank engine/audio/accel.wav engine/audio/decel.wav ...
+The recordings are decoded through the same cache as the player, so it finds the bank current.
+"""
+import json
+import os
+import numpy as np
+from engine.resampler import VariableRateReader
+from engine.cache import DEFAULT_CACHE_DIR, file_hash
+
+BANK_VERSION = 1
+# Whole tone steps from a quarter to three times the recorded speed
+DEFAULT_SPEEDS = tuple(float(speed) for speed in np.geomspace(0.25, 3.0, 22))
+RENDER_BLOCK = 65536
+INT16_SCALE = 32767.0
+
+def bank_source(content_hash, sample_rate) -> str:
+    '''Identifies the decoded recording a bank was rendered from, see bank_exists().'''
+    return f"{content_hash}:{sample_rate}"
+
+def _variant_path(directory, name, speed):
+    return os.path.join(directory, name, f"{speed:.5f}.npy")
+
+def _manifest_path(directory, name):
+    return os.path.join(directory, name, "manifest.json")
+
+def render_variant(data, speed) -> np.ndarray:
+    '''Renders data played at a constant speed as int16 frames.'''
+    reader = VariableRateReader(data)
+    reader.speed = speed
+    frames = int(np.ceil(len(reader) / speed))
+    out = np.empty((frames, reader.data.shape[1]), dtype=np.int16)
+    for start in range(0, frames, RENDER_BLOCK):
+        block = reader.read(min(RENDER_BLOCK, frames - start), speed)
+        block = block.reshape(len(block), -1)
+        out[start:start + len(block)] = np.clip(block * INT16_SCALE, -32768, 32767)
+    return out
+
+def build_bank(directory, name, data, speeds=DEFAULT_SPEEDS, source=None) -> None:
+    '''Writes every variant of one recording, source identifies it in the manifest.'''
+    os.makedirs(os.path.join(directory, name), exist_ok=True)
+    for speed in speeds:
+        variant = render_variant(data, speed)
+        # Written under a temporary name so a crash never leaves a truncated variant behind
+        path = _variant_path(directory, name, speed)
+        np.save(path + ".tmp.npy", variant)
+        os.replace(path + ".tmp.npy", path)
+        print(f"Rendered {name} at {speed:.3f}x: {len(variant)} frames")
+    manifest = {"version": BANK_VERSION, "speeds": list(speeds), "frames": len(data), "source": source}
+    with open(_manifest_path(directory, name), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+def bank_exists(directory, name, speeds=DEFAULT_SPEEDS, source=None) -> bool:
+    try:
+        with open(_manifest_path(directory, name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (manifest.get("version") == BANK_VERSION and manifest.get("speeds") == list(speeds)
+            and manifest.get("source") == source)
+
+class PitchBank:
+    '''Memory mapped variants of one recording, sorted by speed.'''
+    def __init__(self, directory, name):
+        with open(_manifest_path(directory, name)) as f:
+            manifest = json.load(f)
+        self.name = name
+        self.speeds = np.array(manifest["speeds"], dtype=np.float64)
+        self.frames = manifest["frames"]
+        self.variants = [np.load(_variant_path(directory, name, speed), mmap_mode="r") for speed in manifest["speeds"]]
+        self.channels = self.variants[0].shape[1]
+        self.log_speeds = np.log(self.speeds)
+
+class BankReader:
+    '''Same interface as VariableRateReader, reading from a PitchBank instead of filtering.\n
+    position and seek() are in source frames, so switching between the two is seamless.'''
+    def __init__(self, bank, mono=False):
+        self.bank = bank
+        self.mono = mono
+        self.position = 0.0
+        self.speed = 1.0
+
+    def __len__(self):
+        return self.bank.frames
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self)
+
+    def seek(self, position) -> None:
+        self.position = float(position)
+
+    def read(self, frames, speed) -> np.ndarray:
+        '''Returns frames output frames while the speed ramps linearly to the given value.'''
+        bank = self.bank
+        start_speed = self.speed
+        speed = min(max(speed, bank.speeds[0]), bank.speeds[-1])
+        steps = start_speed + (speed - start_speed) * (np.arange(frames) / frames)
+        positions = self.position + np.concatenate(([0.0], np.cumsum(steps[:-1])))
+        self.position += float(steps.sum())
+        self.speed = speed
+
+        # The two variants around the block's speed, mixed by log distance per frame
+        upper = int(np.clip(np.searchsorted(bank.speeds, 0.5 * (start_speed + speed)), 1, len(bank.speeds) - 1))
+        lower = upper - 1
+        mix = (np.log(steps) - bank.log_speeds[lower]) / (bank.log_speeds[upper] - bank.log_speeds[lower])
+        mix = np.clip(mix, 0.0, 1.0).astype(np.float32)[:, np.newaxis]
+        out = self._variant(lower, positions) * (1.0 - mix)
+        out += self._variant(upper, positions) * mix
+        out *= np.float32(1.0 / INT16_SCALE)
+        return out[:, 0] if self.mono else out
+
+    def _variant(self, index, positions) -> np.ndarray:
+        '''Variant frames at the given source positions, linearly interpolated.'''
+        variant = self.bank.variants[index]
+        where = positions / self.bank.speeds[index]
+        base = np.floor(where).astype(np.int64)
+        fraction = (where - base).astype(np.float32)[:, np.newaxis]
+        low = max(int(base[0]), 0)
+        high = min(int(base[-1]) + 2, len(variant))
+        segment = np.zeros((max(int(base[-1]) + 2 - low, 0), self.bank.channels), dtype=np.float32)
+        if high > low:
+            # Only this slice of the mapping is touched
+            segment[:high - low] = variant[low:high]
+        index = np.clip(base - low, 0, len(segment) - 2)
+        return segment[index] * (1.0 - fraction) + segment[index + 1] * fraction
+
+def main():
+    import argparse
+    from engine.decode import SAMPLE_RATE, load_audio
+    parser = argparse.ArgumentParser(description="Pre-render engine recordings at a grid of playback speeds.")
+    parser.add_argument("directory", help="Bank directory")
+    parser.add_argument("sources", nargs="+", help="WAV files, each becomes a bank named after the file")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="Directory of decoded recordings")
+    args = parser.parse_args()
+    for path in args.sources:
+        content_hash = file_hash(path)
+        data = load_audio(path, SAMPLE_RATE, args.cache, content_hash)
+        name = os.path.splitext(os.path.basename(path))[0]
+        build_bank(args.directory, name, data, source=bank_source(content_hash, SAMPLE_RATE))
+
+if __name__ == "__main__":
+    main()
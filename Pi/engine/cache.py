@@ -0,0 +1,38 @@
+import hashlib
+import os
+import numpy as np
+
+# Bump whenever decoding changes (normalisation, resampling, dtype) so old entries are not used
+PROCESSING_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio", "cache")
+HASH_BLOCK = 1 << 20
+
+def file_hash(path) -> str:
+    '''SHA-256 of a file's contents.'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(directory, path, sample_rate, content_hash=None) -> str:
+    '''Where the decoded audio of path at sample_rate is cached.'''
+    content_hash = content_hash or file_hash(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, f"{name}-{content_hash[:20]}-{sample_rate}-v{PROCESSING_VERSION}.npy")
+
+def cached_audio(directory, path, sample_rate, decode, content_hash=None) -> np.ndarray:
+    '''Decoded samples of path, read only and memory mapped from the cache.\n
+    decode(path) is only called on a miss, its result is stored for every later start and
+    every other process: they all map the same file, so the samples are in RAM once.'''
+    entry = cache_path(directory, path, sample_rate, content_hash)
+    if not os.path.exists(entry):
+        data = decode(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written under a unique temporary name, a process starting at the same time never
+        # sees a partial entry and the last of two concurrent writers simply wins
+        temporary = f"{entry}.{os.getpid()}.tmp.npy"
+        np.save(temporary, np.ascontiguousarray(data))
+        os.replace(temporary, entry)
+        print(f"Cached decoded audio of {path} in {entry}")
+    return np.load(entry, mmap_mode="r")
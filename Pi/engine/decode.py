@@ -0,0 +1,39 @@
+'''
+Decoding of the engine recordings into float32 samples at the playback rate.
+The player and the bank pre-build both load through here, so a bank rendered offline
+is made from exactly the samples the player would have rendered it from.
+'''
+import os
+import numpy as np
+import scipy.io.wavfile as wav
+from startup import profile
+from engine.cache import cached_audio
+
+SAMPLE_RATE = 44100  # Sample rate for audio playback
+
+def _resampy():
+    '''resampy pulls in numba, which takes seconds to import on the Pi, so it is only loaded once needed.'''
+    import resampy
+    return resampy
+
+def decode_audio(path, sample_rate=SAMPLE_RATE) -> np.ndarray:
+    '''Reads a WAV file as float32 in [-1, 1], resampled to sample_rate if needed.'''
+    with profile.phase(f"decode {os.path.basename(path)}"):
+        rate, data = wav.read(path)
+        if data.dtype != np.float32:
+            data = data / np.iinfo(data.dtype).max
+        data = data.astype(np.float32)
+
+        if rate != sample_rate:
+            if data.ndim == 1:
+                data = _resampy().resample(data, rate, sample_rate)
+            else:
+                data = _resampy().resample(data.T, rate, sample_rate).T
+    return data
+
+def load_audio(path, sample_rate=SAMPLE_RATE, cache_dir=None, content_hash=None) -> np.ndarray:
+    '''Decoded samples of path, memory mapped from cache_dir (see engine.cache) unless it is None.'''
+    if cache_dir is None:
+        return decode_audio(path, sample_rate)
+    with profile.phase(f"load {os.path.basename(path)}"):
+        return cached_audio(cache_dir, path, sample_rate, lambda path: decode_audio(path, sample_rate), content_hash)
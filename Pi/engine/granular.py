@@ -0,0 +1,62 @@
+import numpy as np
+
+GRAIN_FRAMES = 2048  # About 46 ms at 44.1 kHz, grains overlap by half
+GRAIN_SPREAD = 2048  # Random offset range of grain starts, stops held RPMs from buzzing
+DIRECTION_THRESHOLD = 1.0  # RPM change per block below which the current recording is kept
+
+class GranularEngine:
+    '''Synthesises the engine at any RPM from short windowed grains of the recordings.\n
+    Every grain is cut from where the accelerating (or, while the RPM falls, decelerating)
+    recording passes that RPM, so an RPM can be held for as long as wanted and swept at any
+    rate without reaching the end of a file. Grains are periodic Hann windowed at 50% overlap,
+    which sums to exactly 1, and switching recordings is crossfaded by the windows for free.\n
+    The tables are the recordings' RpmTables.'''
+    def __init__(self, rev_up_data, rev_down_data, rev_up_table, rev_down_table,
+                 grain=GRAIN_FRAMES, spread=GRAIN_SPREAD, seed=None):
+        self.mono = rev_up_data.ndim == 1
+        self.sources = tuple(data if data.ndim == 2 else data[:, np.newaxis] for data in (rev_up_data, rev_down_data))
+        self.tables = (rev_up_table, rev_down_table)
+        self.grain = grain
+        self.hop = grain // 2
+        self.spread = spread
+        self.offsets = np.arange(grain)
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * self.offsets / grain)).astype(np.float32)[:, np.newaxis]
+        channels = self.sources[0].shape[1]
+        self.tail = np.zeros((self.hop, channels), dtype=np.float32)  # Second half of the last grain
+        self.pending = np.zeros((0, channels), dtype=np.float32)  # Finished output not returned yet
+        self.rng = np.random.default_rng(seed)
+        self.rpm = None  # RPM at the end of the last block, the next block ramps from here
+        self.rising = True
+        self.position = 0.0  # Source frame of the last grain
+
+    def read(self, frames, rpm) -> np.ndarray:
+        '''Returns frames output frames while the RPM ramps linearly to the given value.'''
+        start_rpm = rpm if self.rpm is None else self.rpm
+        if rpm - start_rpm > DIRECTION_THRESHOLD:
+            self.rising = True
+        elif start_rpm - rpm > DIRECTION_THRESHOLD:
+            self.rising = False
+        self.rpm = rpm
+
+        count = -(-(frames - len(self.pending)) // self.hop)
+        if count > 0:
+            self.pending = np.concatenate((self.pending, self._grains(start_rpm, rpm, count)))
+        out, self.pending = self.pending[:frames], self.pending[frames:]
+        return out[:, 0] if self.mono else out
+
+    def _grains(self, start_rpm, rpm, count) -> np.ndarray:
+        '''Overlap-adds count new grains and returns the count hops they complete.'''
+        source = 0 if self.rising else 1
+        data = self.sources[source]
+        ramp = start_rpm + (rpm - start_rpm) * (np.arange(1, count + 1) / count)
+        starts = self.tables[source].offset(ramp) + self.rng.uniform(0, self.spread, count)
+        starts = np.clip(starts, 0, len(data) - self.grain).astype(np.int64)
+        self.position = float(starts[-1])
+
+        grains = data[starts[:, np.newaxis] + self.offsets] * self.window
+        # Each hop is a grain's first half plus the second half of the grain before it
+        out = grains[:, :self.hop].copy()
+        out[0] += self.tail
+        out[1:] += grains[:-1, self.hop:]
+        self.tail = grains[-1, self.hop:]
+        return out.reshape(-1, out.shape[2])
@@ -1,13 +1,20 @@
-import numpy as np
 import sounddevice as sd
-import scipy.io.wavfile as wav
-import resampy
+import math
 import queue
 import time
 import os
 from threading import Thread
+from startup import profile
+from engine.resampler import VariableRateReader
+from engine.ring import AudioRingBuffer
+from engine.bank import PitchBank, BankReader, build_bank, bank_exists, bank_source
+from engine.granular import GranularEngine
+from engine.rpm_table import load_rpm_tables
+from engine.cache import DEFAULT_CACHE_DIR, file_hash
+from engine.decode import SAMPLE_RATE, load_audio
 
-SAMPLE_RATE = 44100  # Sample rate for audio playback
+CALLBACK_BLOCK_SIZE = 256  # Frames per audio callback, about 6 ms
+CALLBACK_FILL_BLOCKS = 4  # Callback blocks kept queued ahead of the device, about 23 ms
 
 class EngineAudioStatus:
     '''Class to represent the status of the audio engine.'''
@@ -46,32 +53,117 @@ class EngineChunk:
             raise KeyError(f"Invalid key: {key}")
         
 class EngineAudioPlayer:
-    def __init__(self, rev_up_path, rev_down_path, chunk_duration, target = 1, max_buffer_size = 2):
+    '''Plays the engine recordings, fed chunk by chunk through play_chunk().\n
+    By default the sound device pulls blocks of block_size frames from a ring buffer in its
+    callback and producers stop once fill_blocks blocks are queued, so latency is set by the
+    block size rather than the chunk duration and a late producer only costs silence.
+    callback=False keeps the old writer thread doing blocking writes of whole chunks,
+    target and max_buffer_size count its chunks.\n
+    With bank_dir the recordings are played from pre-rendered speed variants (see engine.bank),
+    rendered there first if they are missing or stale.\n
+    With timestamps_path the engine can also be driven by RPM through play_rpm(), granular=False
+    only loads the RPM tables for estimate_rpm() and matching_position().\n
+    Decoded recordings are memory mapped from cache_dir (see engine.cache), None decodes every time.'''
+    def __init__(self, rev_up_path, rev_down_path, chunk_duration, target = 1, max_buffer_size = 2,
+                 callback=True, block_size=CALLBACK_BLOCK_SIZE, bank_dir=None, timestamps_path=None,
+                 cache_dir=DEFAULT_CACHE_DIR, fill_blocks=CALLBACK_FILL_BLOCKS, granular=True):
+        self.cache_dir = cache_dir
+        self.hashes = {}  # Content hash of every recording loaded through the cache
         self.rev_up_data = self._load_and_preprocess_audio(rev_up_path)
         self.rev_down_data = self._load_and_preprocess_audio(rev_down_path)
+        # Streaming readers keep their position and speed between chunks, see play_chunk()
+        self.rev_up_reader = self._create_reader(rev_up_path, self.rev_up_data, bank_dir)
+        self.rev_down_reader = self._create_reader(rev_down_path, self.rev_down_data, bank_dir)
+        self.granular = None
+        self.rpm_tables = None
+        if timestamps_path is not None:
+            self.rpm_tables = load_rpm_tables(timestamps_path, SAMPLE_RATE)
+        if self.rpm_tables is not None and granular:
+            self.granular = GranularEngine(self.rev_up_data, self.rev_down_data,
+                                           self.rpm_tables["accel"], self.rpm_tables["decel"])
         # self.idle = self._load_and_preprocess_audio(idle_path)
         # self.rev_max = self._load_and_preprocess_audio(rev_max_path)
 
         # Increase buffer size and add a minimum buffer threshold
-        self.buffer = queue.Queue(maxsize=max_buffer_size)
         self.buffer_target = target
         self.running = True
         self.playback_started = False
-        block_size = self._calculate_optimal_blocksize(chunk_duration)
+        self.xruns = 0  # Underflows reported by the audio driver
+        channels = 2 if self.rev_up_data.ndim == 2 else 1
 
-        self.stream = sd.OutputStream(
-            samplerate=SAMPLE_RATE,
-            channels=2 if self.rev_up_data.ndim == 2 else 1,
-            dtype='float32',
-            blocksize=block_size,
-            latency='low'
-        )
+        if callback:
+            self.buffer = None
+            # Everything in the ring is latency, so it only holds a few callback blocks
+            self.ring = AudioRingBuffer(fill_blocks * block_size, channels)
+            self.start_frames = self.ring.capacity
+            # How long a producer can wait when play_chunk() reports the ring full
+            self.block_duration = block_size / SAMPLE_RATE
+            self.writer_thread = None
+            self.stream = sd.OutputStream(
+                samplerate=SAMPLE_RATE,
+                channels=channels,
+                dtype='float32',
+                blocksize=block_size,
+                latency='low',
+                callback=self._callback
+            )
+        else:
+            self.buffer = queue.Queue(maxsize=max_buffer_size)
+            self.ring = None
+            self.block_duration = chunk_duration / 2
+            block_size = self._calculate_optimal_blocksize(chunk_duration)
+            self.stream = sd.OutputStream(
+                samplerate=SAMPLE_RATE,
+                channels=channels,
+                dtype='float32',
+                blocksize=block_size,
+                latency='low'
+            )
+            self.writer_thread = Thread(target=self._buffer_writer, daemon=True)
         self.stream.start()
-
-        self.writer_thread = Thread(target=self._buffer_writer, daemon=True)
-        self.writer_thread.start()
+        if self.writer_thread is not None:
+            self.writer_thread.start()
         print("Audio player initialized and started.")
 
+    def _callback(self, outdata, frames, time_info, status):
+        # Runs on the audio thread: no allocation, no locks, no printing
+        if status.output_underflow:
+            self.xruns += 1
+        if not self.playback_started:
+            if len(self.ring) < self.start_frames:
+                outdata.fill(0)
+                return
+            self.playback_started = True
+        self.ring.read_into(outdata)
+
+    def sample_arrays(self, speed=None) -> list:
+        '''Arrays read while playing, e.g. to lock them into RAM.\n
+        With a bank these are its memory mapped variants, the decoded recordings are then
+        only used to render it (and by the granular engine, which never uses a bank).
+        With speed the variants closest to that playback speed come first, so a caller that
+        can only lock some of them gets the ones played most.'''
+        ranked = []  # (distance from speed in octaves, array)
+        for reader in (self.rev_up_reader, self.rev_down_reader):
+            if isinstance(reader, BankReader):
+                for variant_speed, variant in zip(reader.bank.speeds, reader.bank.variants):
+                    ranked.append((abs(math.log2(variant_speed / speed)) if speed else 0.0, variant))
+            else:
+                ranked.append((0.0, reader.data))
+        if self.granular is not None:
+            ranked.extend(((0.0, self.rev_up_data), (0.0, self.rev_down_data)))
+        return [array for _, array in sorted(ranked, key=lambda entry: entry[0])]
+
+    def stats(self) -> dict:
+        '''Output health: callback underruns (blocks padded with silence) and driver xruns.'''
+        if self.ring is None:
+            return {"queued_chunks": self.buffer.qsize(), "xruns": self.xruns}
+        return {
+            "buffered_frames": len(self.ring),
+            "underruns": self.ring.underruns,
+            "underrun_frames": self.ring.underrun_frames,
+            "xruns": self.xruns,
+        }
+
     def _calculate_optimal_blocksize(self, chunk_duration):
         """Calculate the optimal blocksize based on typical chunk parameters"""
         # Calculate samples for a typical chunk after resampling
@@ -96,20 +188,24 @@ class EngineAudioPlayer:
     def _load_and_preprocess_audio(self, path):
         if not os.path.exists(path):
             raise FileNotFoundError(f"Audio file not found: {path}")
-        
-        sr, data = wav.read(path)
-        if data.dtype != np.float32:
-            data = data / np.iinfo(data.dtype).max
-        data = data.astype(np.float32)
 
-        if sr != SAMPLE_RATE:
-            if data.ndim == 1:
-                data = resampy.resample(data, sr, SAMPLE_RATE)
-            else:
-                data = resampy.resample(data.T, sr, SAMPLE_RATE).T
+        if self.cache_dir is not None:
+            self.hashes[path] = file_hash(path)
+        data = load_audio(path, SAMPLE_RATE, self.cache_dir, self.hashes.get(path))
         print(f"Loaded and preprocessed audio from {path}: {data.shape} samples at {SAMPLE_RATE} Hz")
         return data
 
+    def _create_reader(self, path, data, bank_dir):
+        if bank_dir is None:
+            return VariableRateReader(data)
+        name = os.path.splitext(os.path.basename(path))[0]
+        source = bank_source(self.hashes.get(path) or file_hash(path), SAMPLE_RATE)
+        if not bank_exists(bank_dir, name, source=source):
+            print(f"Rendering speed variants of {path} into {bank_dir}, this takes a while once")
+            with profile.phase(f"render bank {name}"):
+                build_bank(bank_dir, name, data, source=source)
+        return BankReader(PitchBank(bank_dir, name), mono=data.ndim == 1)
+
     def _buffer_writer(self):
         while self.running:
             try:
@@ -134,68 +230,91 @@ class EngineAudioPlayer:
                 self.stop()
 
     def play_chunk(self, rev_up, start_time, speed, duration) -> EngineAudioStatus:
+        '''Queues duration seconds of the recording played from start_time (source seconds) at speed.\n
+        Pass the returned position as the next start_time: chunks then continue the same stream
+        seamlessly, with the speed ramping smoothly from the previous chunk. Any other start_time
+        is a jump.'''
         if(self.running == False):
             print("Audio player is not running.")
             return EngineAudioStatus(False, False, 0, 0, "Audio player is not running.")
-        print("Playing chunk...")
-        data = self.rev_up_data if rev_up else self.rev_down_data
-        start_sample = int(start_time * SAMPLE_RATE) # * speed
-        total_samples = data.shape[0]
-        requested_samples = int(duration * speed * SAMPLE_RATE)
-        end_sample = start_sample + requested_samples
-        print("\tCalculated Chunk")
-
-        if start_sample >= total_samples:
+        reader = self.rev_up_reader if rev_up else self.rev_down_reader
+        start_sample = start_time * SAMPLE_RATE
+        if start_sample >= len(reader):
             # End of file reached
             return EngineAudioStatus(True, False, 0, start_time)
+        frames = int(round(duration * SAMPLE_RATE))
+        if self.ring is not None:
+            # Render only what fits, the rest of the chunk is simply asked for again later
+            frames = min(frames, self.ring.space)
+            full = frames == 0
+        else:
+            full = self.buffer.full()
+        if full:
+            # Checked first so the reader does not move on for a chunk that is thrown away
+            return EngineAudioStatus(False, True, duration, start_time)
 
-        chunk = data[start_sample:min(end_sample, total_samples)]
-        print("\tChunk sliced")
+        if abs(reader.position - start_sample) >= 1.0:
+            reader.seek(start_sample)
+        # The reader returns exactly the frames asked for, so chunks butt together without fades
+        chunk = reader.read(frames, speed)
+        duration = frames / SAMPLE_RATE
 
-        # Resample for speed
-        if speed != 1.0:
-            print("\tResampling chunk")
-            if chunk.ndim == 1:
-                chunk = resampy.resample(chunk, SAMPLE_RATE * speed, SAMPLE_RATE, parallel=True)
-            else:
-                chunk = resampy.resample(chunk.T, SAMPLE_RATE * speed, SAMPLE_RATE, parallel=True).T
-            print("\tChunk resampled, applying fade")
+        dropped = False
+        if self.ring is not None:
+            self.ring.write(chunk)
+        else:
+            try:
+                self.buffer.put_nowait(EngineChunk(chunk, duration))
+            except queue.Full:
+                dropped = True
+        return EngineAudioStatus(False, dropped, duration, reader.position / SAMPLE_RATE)
 
-            # Apply very small fade in/out to reduce clicking
-            fade_samples = min(int(0.005 * SAMPLE_RATE), len(chunk) // 8)  # 5ms or 1/8 of chunk
-            if fade_samples > 0:
-                fade_in = np.linspace(0, 1, fade_samples)
-                fade_out = np.linspace(1, 0, fade_samples)
-                
-                if chunk.ndim == 1:  # Mono
-                    chunk[:fade_samples] *= fade_in
-                    chunk[-fade_samples:] *= fade_out
-                else:  # Stereo
-                    chunk[:fade_samples] *= fade_in.reshape(-1, 1)
-                    chunk[-fade_samples:] *= fade_out.reshape(-1, 1)
-                print("\tFade applied")
+    def estimate_rpm(self, rev_up, position) -> float:
+        '''Engine RPM heard at position (source seconds) of a recording, None without timestamps.'''
+        if self.rpm_tables is None:
+            return None
+        return self.rpm_tables["accel" if rev_up else "decel"].rpm_at(position * SAMPLE_RATE)
 
-        print("\tEnsuring chunk is contiguous")
-        # Make sure data is contiguous when putting in buffer
-        chunk = np.ascontiguousarray(chunk)
-    
-        print("\tPutting chunk in buffer")
-        dropped = False
-        try:
-            self.buffer.put_nowait(EngineChunk(chunk, duration))
-            print("\t\tChunk added to buffer")
-        except queue.Full:
-            dropped = True
-            print("\t\tBuffer full, dropping chunk")
+    def matching_position(self, rev_up, position) -> float:
+        '''Position (source seconds) in the other recording with the RPM heard at position of this one.\n
+        Lets a switch between revving up and down carry on at the same pitch, None without timestamps.'''
+        rpm = self.estimate_rpm(rev_up, position)
+        if rpm is None:
+            return None
+        return self.rpm_tables["decel" if rev_up else "accel"].offset_at(rpm) / SAMPLE_RATE
 
-        print("\t\tBuffer size:", self.buffer.qsize())
+    def play_rpm(self, rpm, duration) -> EngineAudioStatus:
+        '''Queues duration seconds of granular engine sound ramping to rpm, see GranularEngine.\n
+        Never reaches the end of a file, position is where the last grain was cut (source seconds).'''
+        if self.granular is None:
+            return EngineAudioStatus(False, False, 0, 0, "No timestamps loaded, play_rpm() is unavailable.")
+        if(self.running == False):
+            return EngineAudioStatus(False, False, 0, 0, "Audio player is not running.")
+        frames = int(round(duration * SAMPLE_RATE))
+        if self.ring is not None:
+            frames = min(frames, self.ring.space)
+            full = frames == 0
+        else:
+            full = self.buffer.full()
+        if full:
+            return EngineAudioStatus(False, True, duration, self.granular.position / SAMPLE_RATE)
 
-        print("\tDone")
-        return EngineAudioStatus(False, dropped, duration, start_time + duration)
+        chunk = self.granular.read(frames, rpm)
+        duration = frames / SAMPLE_RATE
+        dropped = False
+        if self.ring is not None:
+            self.ring.write(chunk)
+        else:
+            try:
+                self.buffer.put_nowait(EngineChunk(chunk, duration))
+            except queue.Full:
+                dropped = True
+        return EngineAudioStatus(False, dropped, duration, self.granular.position / SAMPLE_RATE)
 
     def stop(self):
         self.running = False
-        self.writer_thread.join()
+        if self.writer_thread is not None:
+            self.writer_thread.join()
         self.stream.stop()
         self.stream.close()
 
@@ -251,7 +370,7 @@ class EngineAudioUI:
             
             # Update for next iteration
             if not done['dropped']:
-                counter += done["waitTime"]
+                counter = done["position"]
 
             if done['done']:
                 print("End of file reached.")
@@ -0,0 +1,85 @@
+import numpy as np
+
+# Zero crossings of the interpolation kernel on each side at full bandwidth
+KERNEL_HALF_WIDTH = 8
+# Kernel table points per zero crossing, values in between are interpolated linearly
+TABLE_RESOLUTION = 512
+
+def _kernel_table(half_width, resolution):
+    '''Right half of a Blackman windowed sinc, sampled resolution times per unit.\n
+    Padded with zeros so lookups just past the end need no bounds check.'''
+    u = np.arange(half_width * resolution + 2, dtype=np.float64) / resolution
+    window = 0.42 + 0.5 * np.cos(np.pi * u / half_width) + 0.08 * np.cos(2 * np.pi * u / half_width)
+    table = np.sinc(u) * np.where(u < half_width, window, 0.0)
+    return np.append(table, 0.0).astype(np.float32)
+
+class VariableRateReader:
+    '''Plays a sample array at a smoothly varying speed, one block at a time.\n
+    The fractional read position is kept between calls and the interpolation kernel
+    reads across block boundaries, so consecutive blocks join without clicks and
+    need no fades. Every read returns exactly the number of frames asked for.\n
+    Speeds above 1 narrow the kernel's passband to 1/speed so nothing aliases.'''
+    def __init__(self, data, half_width=KERNEL_HALF_WIDTH, resolution=TABLE_RESOLUTION):
+        self.data = data if data.ndim == 2 else data[:, np.newaxis]
+        self.mono = data.ndim == 1
+        self.half_width = half_width
+        self.resolution = resolution
+        self.table = _kernel_table(half_width, resolution)
+        self.position = 0.0  # Read position in source frames
+        self.speed = 1.0  # Speed at the end of the last block, the next block ramps from here
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self)
+
+    def seek(self, position) -> None:
+        '''Jumps to a source frame. Unlike reading on, this is a discontinuity.'''
+        self.position = float(position)
+
+    def read(self, frames, speed) -> np.ndarray:
+        '''Returns frames output frames while the speed ramps linearly to the given value.\n
+        Past the end of the data the output is silence.'''
+        start_speed = self.speed
+        steps = start_speed + (speed - start_speed) * (np.arange(frames) / frames)
+        positions = self.position + np.concatenate(([0.0], np.cumsum(steps[:-1])))
+        self.position += float(steps.sum())
+        self.speed = speed
+
+        if start_speed == speed == 1.0 and positions[0] == int(positions[0]):
+            # Whole frame steps, the kernel would reproduce the input exactly
+            out = self._slice(int(positions[0]), frames)
+        else:
+            out = self._interpolate(positions, max(start_speed, speed))
+        return out[:, 0] if self.mono else out
+
+    def _slice(self, start, frames) -> np.ndarray:
+        out = np.zeros((frames, self.data.shape[1]), dtype=np.float32)
+        available = self.data[max(start, 0):max(start + frames, 0)]
+        offset = max(-start, 0)
+        out[offset:offset + len(available)] = available[:frames - offset]
+        return out
+
+    def _interpolate(self, positions, speed) -> np.ndarray:
+        cutoff = 1.0 / max(1.0, speed)
+        reach = int(np.ceil(self.half_width / cutoff))
+        offsets = np.arange(-reach + 1, reach + 1)
+        base = np.floor(positions).astype(np.int64)
+        fraction = (positions - base).astype(np.float32)
+
+        # Kernel weights for every (output frame, tap), looked up in the table
+        distance = np.abs(offsets[np.newaxis, :].astype(np.float32) - fraction[:, np.newaxis])
+        distance *= np.float32(cutoff * self.resolution)
+        index = np.minimum(distance.astype(np.int64), len(self.table) - 2)
+        blend = distance - index
+        weights = self.table[index] * (1.0 - blend) + self.table[index + 1] * blend
+        weights *= np.float32(cutoff)
+
+        # Every input frame the block touches, zero padded outside the data
+        low = int(base[0]) + offsets[0]
+        high = int(base[-1]) + offsets[-1] + 1
+        segment = self._slice(low, high - low)
+        taps = segment[(base - low)[:, np.newaxis] + offsets[np.newaxis, :]]
+        return np.einsum("ft,ftc->fc", weights, taps, optimize=True).astype(np.float32)
@@ -0,0 +1,59 @@
+import numpy as np
+
+class AudioRingBuffer:
+    '''Preallocated frame ring between one producer and the audio callback.\n
+    write_index and read_index only ever grow and each is only assigned by one side,
+    after its copy is done, so neither side takes a lock. Both reads and writes may be
+    partial: a write stores what fits, a read fills the rest of its block with silence.'''
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, channels), dtype=dtype)
+        self.write_index = 0  # Frames ever written, only changed by the producer
+        self.read_index = 0  # Frames ever read, only changed by the consumer
+        self.underruns = 0  # Reads that could not be filled completely
+        self.underrun_frames = 0  # Frames of silence played because of them
+
+    def __len__(self):
+        '''Frames waiting to be read.'''
+        return self.write_index - self.read_index
+
+    @property
+    def space(self) -> int:
+        '''Frames that can be written without overwriting unread audio.'''
+        return self.capacity - (self.write_index - self.read_index)
+
+    def write(self, frames) -> int:
+        '''Copies as many of the given frames as fit and returns how many that was.'''
+        count = min(len(frames), self.space)
+        if count <= 0:
+            return 0
+        start = self.write_index % self.capacity
+        first = min(count, self.capacity - start)
+        self.data[start:start + first] = frames[:first].reshape(first, -1)
+        if count > first:
+            self.data[:count - first] = frames[first:count].reshape(count - first, -1)
+        # Publish only after the copy, the callback never sees half written frames
+        self.write_index += count
+        return count
+
+    def read_into(self, out, count_underruns=True) -> int:
+        '''Fills out (frames x channels) from the ring, silence for whatever is missing.\n
+        Returns the number of real frames copied.'''
+        wanted = len(out)
+        count = min(wanted, self.write_index - self.read_index)
+        start = self.read_index % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        if count > first:
+            out[first:count] = self.data[:count - first]
+        if count < wanted:
+            out[count:] = 0
+            if count_underruns:
+                self.underruns += 1
+                self.underrun_frames += wanted - count
+        self.read_index += count
+        return count
+
+    def clear(self) -> None:
+        '''Drops unread audio. Only call it from the consumer side or while it is stopped.'''
+        self.read_index = self.write_index
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+
+RPM_STEP = 1.0  # RPM resolution of the RPM -> offset lookup table
+OFFSET_STEP = 64  # Frame resolution of the offset -> RPM lookup table, about 1.5 ms
+
+class RpmTable:
+    '''Where a recording passes each RPM, as sample offsets, and the reverse.\n
+    offset() and rpm() interpolate arrays of queries exactly, offset_at() and rpm_at() are
+    O(1) lookups of single values in dense tables built once, accurate to RPM_STEP and
+    OFFSET_STEP. Queries outside the table are clamped to its ends.'''
+    def __init__(self, rpms, offsets, rpm_step=RPM_STEP, offset_step=OFFSET_STEP):
+        order = np.argsort(rpms)
+        self.rpms = np.asarray(rpms, dtype=np.float64)[order]
+        self.offsets = np.asarray(offsets, dtype=np.float64)[order]
+        steps = np.diff(self.offsets)
+        if not (np.all(steps > 0) or np.all(steps < 0)):
+            raise ValueError("Recording positions must move monotonically with RPM")
+        # The inverse needs ascending offsets, a decelerating recording has them descending
+        inverse = np.argsort(self.offsets)
+        self.sorted_offsets = self.offsets[inverse]
+        self.sorted_rpms = self.rpms[inverse]
+
+        self.rpm_step = rpm_step
+        self.offset_step = offset_step
+        self.offset_lut = self.offset(np.arange(self.rpms[0], self.rpms[-1] + rpm_step, rpm_step))
+        self.rpm_lut = self.rpm(np.arange(self.sorted_offsets[0], self.sorted_offsets[-1] + offset_step, offset_step))
+
+    @property
+    def min_rpm(self) -> float:
+        return self.rpms[0]
+
+    @property
+    def max_rpm(self) -> float:
+        return self.rpms[-1]
+
+    def offset(self, rpm):
+        '''Sample offsets of RPMs, scalars or arrays.'''
+        return np.interp(rpm, self.rpms, self.offsets)
+
+    def rpm(self, offset):
+        '''RPMs at sample offsets, scalars or arrays.'''
+        return np.interp(offset, self.sorted_offsets, self.sorted_rpms)
+
+    def offset_at(self, rpm) -> float:
+        index = int((rpm - self.rpms[0]) / self.rpm_step + 0.5)
+        return self.offset_lut[min(max(index, 0), len(self.offset_lut) - 1)]
+
+    def rpm_at(self, offset) -> float:
+        index = int((offset - self.sorted_offsets[0]) / self.offset_step + 0.5)
+        return self.rpm_lut[min(max(index, 0), len(self.rpm_lut) - 1)]
+
+def load_rpm_tables(path, sample_rate) -> dict:
+    '''Recording name -> RpmTable from timestamps.json, which maps RPM strings to seconds.'''
+    with open(path) as f:
+        timestamps = json.load(f)
+    tables = {}
+    for name, points in timestamps.items():
+        rpms = np.array([float(rpm) for rpm in points], dtype=np.float64)
+        seconds = np.array([float(time) for time in points.values()], dtype=np.float64)
+        tables[name] = RpmTable(rpms, seconds * sample_rate)
+    return tables
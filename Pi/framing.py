@@ -0,0 +1,162 @@
+'''
+Binary framing used by the microcontrollers once binary mode has been negotiated.
+
+Frame layout before encoding:
+    type (u8) | seq (u8) | payload | crc16 (u16, little endian)
+The crc is CRC-16/CCITT-FALSE over type, seq and payload.
+Frames are COBS encoded and terminated by a single 0x00 byte.
+
+Keep the layouts in sync with Pico/include/framing.py and Arduino sensor.ino.
+'''
+import binascii
+import json
+import struct
+
+PROTOCOL_VERSION = 2
+
+# Frame types
+FRAME_PICO_STATE = 0x01
+FRAME_ARDUINO_STATE = 0x02
+FRAME_STATUS = 0x7F  # Payload is a UTF-8 JSON object, used for rare status replies
+FRAME_REPLY = 0x40  # Flag on a state frame type: payload starts with the u16 request id
+REPLY_ID = struct.Struct("<H")
+
+PICO_STATE = struct.Struct("<fBiBI")    # steer, button, knob count, knob switch, ticks_us
+ARDUINO_STATE = struct.Struct("<fffI")  # throttle, break, speed, micros
+
+HEADER_SIZE = 2
+CRC_SIZE = 2
+MAX_FRAME_SIZE = 256
+
+def crc16(data) -> int:
+    '''CRC-16/CCITT-FALSE, matches the firmware implementations.'''
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def cobs_encode(data) -> bytes:
+    '''Encodes data so that it contains no zero bytes.'''
+    out = bytearray()
+    for block in bytes(data).split(b"\x00"):
+        # A code byte can describe at most 254 data bytes
+        while len(block) >= 254:
+            out.append(0xFF)
+            out += block[:254]
+            block = block[254:]
+        out.append(len(block) + 1)
+        out += block
+    return bytes(out)
+
+def cobs_decode(data) -> bytes:
+    '''Decodes a single COBS block (without the trailing 0x00).\n
+    Raises ValueError on malformed input.'''
+    out = bytearray()
+    index = 0
+    length = len(data)
+    while index < length:
+        code = data[index]
+        if code == 0 or index + code > length:
+            raise ValueError("Malformed COBS block")
+        out += data[index + 1:index + code]
+        index += code
+        if code != 0xFF and index < length:
+            out.append(0)
+    return bytes(out)
+
+def encode_frame(frame_type: int, seq: int, payload: bytes) -> bytes:
+    '''Builds a complete, delimited frame ready to be written to a port.'''
+    raw = bytes((frame_type, seq & 0xFF)) + payload
+    raw += struct.pack("<H", crc16(raw))
+    return cobs_encode(raw) + b"\x00"
+
+def frame_to_message(frame_type: int, payload) -> dict:
+    '''Converts a decoded payload to the same dict shape the JSON protocol produces.'''
+    if frame_type != FRAME_STATUS and frame_type & FRAME_REPLY:
+        # Reply to a command carrying an id, the state follows the id
+        (request_id,) = REPLY_ID.unpack_from(payload)
+        message = frame_to_message(frame_type & ~FRAME_REPLY, payload[REPLY_ID.size:])
+        message["id"] = request_id
+        return message
+    if frame_type == FRAME_PICO_STATE:
+        steer, button, count, switch, ticks = PICO_STATE.unpack_from(payload)
+        return {
+            'steer': steer,
+            'button': bool(button),
+            'knob': {
+                "count": count,
+                "switch": bool(switch)
+            },
+            't': ticks
+        }
+    elif frame_type == FRAME_ARDUINO_STATE:
+        throttle, brake, speed, ticks = ARDUINO_STATE.unpack_from(payload)
+        return {"throttle": throttle, "break": brake, "speed": speed, "t": ticks}
+    elif frame_type == FRAME_STATUS:
+        return json.loads(bytes(payload).decode())
+    raise ValueError(f"Unknown frame type: {frame_type:#x}")
+
+class FrameDecoder:
+    '''Incrementally splits a byte stream into frames and validates them.\n
+    Keeps counters for crc failures, malformed frames and sequence gaps.'''
+    def __init__(self):
+        self.buffer = bytearray()
+        self.last_seq = None
+        self.crc_errors = 0
+        self.malformed = 0
+        self.lost_frames = 0
+        self.frames = 0
+        self.stopped = False  # The last feed() returned early at a frame of its stop_type
+
+    def reset(self):
+        self.buffer.clear()
+        self.last_seq = None
+
+    def feed(self, data, stop_type=None) -> list:
+        '''Adds raw bytes and returns a list of (frame_type, seq, payload) for every complete frame.\n
+        With stop_type it returns right after a frame of that type and sets stopped, the bytes
+        after it stay in buffer. Lets the caller act on e.g. a protocol switch before going on.'''
+        self.buffer += data
+        frames = []
+        start = 0
+        self.stopped = False
+        while True:
+            end = self.buffer.find(b"\x00", start)
+            if end == -1:
+                break
+            block = self.buffer[start:end]
+            start = end + 1
+            if not block:
+                continue
+            frame = self._decode_block(block)
+            if frame is not None:
+                frames.append(frame)
+                if frame[0] == stop_type:
+                    self.stopped = True
+                    break
+        if start:
+            del self.buffer[:start]
+        if not self.stopped and len(self.buffer) > MAX_FRAME_SIZE:
+            # No delimiter in sight, the stream is garbage so resync on the next zero byte
+            self.buffer.clear()
+            self.malformed += 1
+        return frames
+
+    def _decode_block(self, block):
+        try:
+            raw = cobs_decode(block)
+        except ValueError:
+            self.malformed += 1
+            return None
+        if len(raw) < HEADER_SIZE + CRC_SIZE:
+            self.malformed += 1
+            return None
+        body = memoryview(raw)[:-CRC_SIZE]
+        (received_crc,) = struct.unpack_from("<H", raw, len(raw) - CRC_SIZE)
+        if crc16(body) != received_crc:
+            self.crc_errors += 1
+            return None
+        frame_type = raw[0]
+        seq = raw[1]
+        if self.last_seq is not None:
+            self.lost_frames += (seq - self.last_seq - 1) & 0xFF
+        self.last_seq = seq
+        self.frames += 1
+        return (frame_type, seq, body[HEADER_SIZE:])
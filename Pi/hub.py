@@ -0,0 +1,189 @@
+import asyncio
+from collections.abc import Mapping
+from jerial import JSONSerialReader
+
+def _expects_status(message) -> bool:
+    return isinstance(message, Mapping) and "status" in message
+
+def _expects_sample(message) -> bool:
+    # Schema decoded samples are Records, which are Mappings but not dicts
+    return isinstance(message, Mapping) and "status" not in message
+
+class SerialHub:
+    '''Owns every serial device and multiplexes them on a single asyncio event loop.\n
+    Ports are watched with loop.add_reader so nothing busy polls while the link is idle.\n
+    Requires a selector based event loop, which is the default on Linux.'''
+    def __init__(self):
+        self.devices = {}
+        self.subscribers = []  # (device name or None for every device, callback)
+        self.pending = {}  # device name -> list of (predicate, future) waiting for a reply
+        self.watched = {}  # device name -> watched file descriptor, the port object changes on reconnect
+        self.loop = None
+
+    def add_device(self, name, port, baud=115200, reconnect=True, coalesce=True, **kwargs) -> JSONSerialReader:
+        '''Opens a port and registers it under name. Extra arguments go to JSONSerialReader.\n
+        Devices reconnect in the background when unplugged unless reconnect is False.\n
+        Commands are coalesced by default, everything sent during one loop iteration goes out in one write.'''
+        return self.attach(name, JSONSerialReader(port, baud, reconnect=reconnect, coalesce=coalesce, **kwargs))
+
+    def attach(self, name, reader) -> JSONSerialReader:
+        '''Registers an already opened reader under name.'''
+        if name in self.devices:
+            raise ValueError(f"Device already registered: {name}")
+        self.devices[name] = reader
+        self.pending[name] = []
+        reader.subscribe(lambda timestamp, message: self._dispatch(name, timestamp, message))
+        reader.connection_listeners.append(lambda state: self._on_connection(name, state))
+        reader.flush_requested = lambda: self._request_flush(name)
+        if self.loop is not None:
+            self._watch(name)
+        return reader
+
+    def subscribe(self, callback, name=None):
+        '''Registers callback(name, timestamp, message).\n
+        Pass a device name to only receive messages from that device.'''
+        self.subscribers.append((name, callback))
+
+    def unsubscribe(self, callback):
+        self.subscribers = [entry for entry in self.subscribers if entry[1] != callback]
+
+    async def start(self):
+        '''Starts watching every registered device on the running loop.'''
+        self.loop = asyncio.get_running_loop()
+        for name, reader in self.devices.items():
+            self._watch(name)
+            if reader.connected:
+                reader.flush()  # Anything queued before the loop existed
+
+    async def run(self):
+        '''Starts the hub and serves devices until cancelled.'''
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            self.close()
+
+    def close(self):
+        for name, reader in self.devices.items():
+            self._unwatch(name)
+            for predicate, future in self.pending[name]:
+                future.cancel()
+            reader.close()
+
+    def _watch(self, name):
+        reader = self.devices[name]
+        if not reader.connected or name in self.watched:
+            return  # Watched again once the reconnect succeeds
+        fd = reader.ser.fileno()
+        self.loop.add_reader(fd, self._on_readable, name)
+        self.watched[name] = fd
+
+    def _unwatch(self, name):
+        fd = self.watched.pop(name, None)
+        if self.loop is None or fd is None:
+            return
+        try:
+            self.loop.remove_reader(fd)
+        except Exception:
+            pass
+
+    def _on_connection(self, name, state):
+        # Called from the reconnect thread as well, only touch the loop from its own thread
+        if self.loop is None or self.loop.is_closed():
+            return
+        if state == "connected":
+            self.loop.call_soon_threadsafe(self._rewatch, name)
+        else:
+            self.loop.call_soon_threadsafe(self._unwatch, name)
+
+    def _rewatch(self, name):
+        self._unwatch(name)
+        self._watch(name)
+
+    def _request_flush(self, name):
+        # Runs after the current callback, so a burst of sends shares one write
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.devices[name].flush)
+
+    def _on_readable(self, name):
+        try:
+            # poll() only reads what is already waiting so it never blocks the loop
+            self.devices[name].poll()
+        except Exception as e:
+            # A vanished port stays readable forever, stop watching it instead of spinning
+            print(f"Error reading {name}, no longer watching: {e}")
+            self._unwatch(name)
+
+    def _dispatch(self, name, timestamp, message):
+        pending = self.pending[name]
+        for index, (predicate, future) in enumerate(pending):
+            if not future.done() and predicate(message):
+                del pending[index]
+                future.set_result(message)
+                break
+        for device, callback in self.subscribers:
+            if device is None or device == name:
+                try:
+                    callback(name, timestamp, message)
+                except Exception as e:
+                    print(f"Error in hub subscriber: {e}")
+
+    def flush(self):
+        '''Writes every queued command now instead of at the end of the loop iteration.'''
+        for reader in self.devices.values():
+            if reader.connected:
+                reader.flush()
+
+    def metrics(self) -> dict:
+        '''Returns a link metrics snapshot for every device, keyed by name.'''
+        return {name: reader.metrics.snapshot() for name, reader in self.devices.items()}
+
+    async def request(self, name, command, expect=None, timeout=1.0, **fields) -> dict:
+        '''Sends {"command": command, **fields} to a device and waits for the matching reply.\n
+        The command is tagged with a fresh request id and the reply echoing it is taken.
+        A device that does not echo ids (the Arduino only does for sync) is matched by shape
+        instead, the next sample for "poll" and the next status message for everything else,
+        but only while it is not streaming since a pushed sample would match too.\n
+        expect is a predicate picking the reply, it replaces the matching above.\n
+        Raises asyncio.TimeoutError if nothing matching arrives in time.'''
+        reader = self.devices[name]
+        fields.setdefault("id", reader.next_request_id())
+        if expect is None:
+            request_id = fields["id"]
+            shape = _expects_sample if command == "poll" else _expects_status
+            def expect(message):
+                reply_id = message.get("id") if isinstance(message, Mapping) else None
+                if reply_id is not None:
+                    return reply_id == request_id
+                return not reader.stream_rate and shape(message)
+        future = asyncio.get_running_loop().create_future()
+        entry = (expect, future)
+        pending = self.pending[name]
+        pending.append(entry)
+        try:
+            reader.send({"command": command, **fields})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if entry in pending:
+                pending.remove(entry)
+
+    async def sync(self, name, count=8, timeout=0.2) -> bool:
+        '''Runs count clock sync exchanges with a device, see JSONSerialReader.sync().'''
+        reader = self.devices[name]
+        for _ in range(count):
+            ping = reader.next_request_id()
+            try:
+                await self.request(name, "sync", timeout=timeout, id=ping,
+                                   expect=lambda message: message.get("status") == "sync" and message.get("id") == ping)
+            except asyncio.TimeoutError:
+                reader.sync_sent.pop(ping, None)
+        return reader.clock.synced
+
+    async def poll(self, name, timeout=1.0) -> dict:
+        return await self.request(name, "poll", timeout=timeout)
+
+    async def tare(self, name, timeout=1.0) -> dict:
+        return await self.request(name, "tare", timeout=timeout)
+
+    async def save(self, name, timeout=1.0) -> dict:
+        return await self.request(name, "save", timeout=timeout)
@@ -1,31 +1,990 @@
 import serial
 import json
+import re
 import time
+import threading
+from collections import deque
+from collections.abc import Mapping
+from framing import FrameDecoder, frame_to_message, PROTOCOL_VERSION, FRAME_STATUS
+from capture import CaptureWriter
+from metrics import Histogram
+from records import Record
+
+MAX_LINE_LENGTH = 4096  # A partial line longer than this is garbage and gets dropped
+
+try:
+    # Optional accelerated JSON backend
+    import orjson
+    _loads = orjson.loads
+    ACCELERATED = True
+    DecodeError = (json.JSONDecodeError, orjson.JSONDecodeError)
+except ImportError:
+    _loads = json.loads
+    ACCELERATED = False
+    DecodeError = json.JSONDecodeError
+
+class KnobState(Record):
+    __slots__ = ("count", "switch")
+    KEYS = ("count", "switch")
+
+    def __init__(self, count, switch):
+        self.count = count
+        self.switch = switch
+
+class PicoState(Record):
+    __slots__ = ("steer", "button", "count", "switch", "t", "id")
+    KEYS = ("steer", "button", "knob", "t", "id")
+
+    def __init__(self, steer, button, count, switch, t=None, id=None):
+        self.steer = steer
+        self.button = button
+        # Stored flat, the nested knob record is only built when asked for
+        self.count = count
+        self.switch = switch
+        self.t = t  # Device ticks_us when the sample was taken
+        self.id = id  # Id of the poll command this answers, None for pushed samples
+
+    @property
+    def knob(self) -> KnobState:
+        return KnobState(self.count, self.switch)
+
+class ArduinoState(Record):
+    __slots__ = ("throttle", "brake", "speed", "t")
+    KEYS = ("throttle", "break", "speed", "t")
+    ATTRIBUTES = {"break": "brake"}
+
+    def __init__(self, throttle, brake, speed, t=None):
+        self.throttle = throttle
+        self.brake = brake
+        self.speed = speed
+        self.t = t  # Device micros() when the sample was taken
+
+class MessageSchema:
+    '''A known message shape with a specialized parser.\n
+    pattern is a bytes regex matching the whole line, build turns its groups into a message.\n
+    Lines that do not match fall through to the generic parser.'''
+    def __init__(self, name, prefix, pattern, build):
+        self.name = name
+        self.prefix = prefix
+        self.regex = re.compile(pattern)
+        self.build = build
+
+    def match(self, data):
+        if not data.startswith(self.prefix):
+            return None
+        match = self.regex.match(data)
+        if match is None:
+            return None
+        return self.build(match.groups())
+
+# Pieces of the firmware output, MicroPython puts spaces after separators and ArduinoJson does not
+_NUMBER = rb"(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)"
+_INT = rb"(-?\d+)"
+_BOOL = rb"(true|false)"
+_SEP = rb", ?"
+_COLON = rb": ?"
+_TICKS = rb'(?:' + _SEP + rb'"t"' + _COLON + rb'(\d+))?'
+_ID = rb'(?:' + _SEP + rb'"id"' + _COLON + rb'(\d+))?'
+_END = rb"\s*\Z"
+
+def _ticks(group):
+    return None if group is None else int(group)
+
+PICO_STATE_SCHEMA = MessageSchema(
+    "pico_state", b'{"steer"',
+    rb'\{"steer"' + _COLON + _NUMBER + _SEP + rb'"button"' + _COLON + _BOOL + _SEP
+    + rb'"knob"' + _COLON + rb'\{"count"' + _COLON + _INT + _SEP + rb'"switch"' + _COLON + _BOOL + rb"\}" + _TICKS + _ID + rb"\}" + _END,
+    lambda groups: PicoState(float(groups[0]), groups[1] == b"true", int(groups[2]), groups[3] == b"true",
+                             _ticks(groups[4]), _ticks(groups[5])))
+
+ARDUINO_STATE_SCHEMA = MessageSchema(
+    "arduino_state", b'{"throttle"',
+    rb'\{"throttle"' + _COLON + _NUMBER + _SEP + rb'"break"' + _COLON + _NUMBER + _SEP
+    + rb'"speed"' + _COLON + _NUMBER + _TICKS + rb"\}" + _END,
+    lambda groups: ArduinoState(float(groups[0]), float(groups[1]), float(groups[2]), _ticks(groups[3])))
+
+STATUS_SCHEMA = MessageSchema(
+    "status", b'{"status"',
+    rb'\{"status"' + _COLON + rb'"([A-Za-z ]*)"\}' + _END,
+    lambda groups: {"status": groups[0].decode()})
+
+DEFAULT_SCHEMAS = (PICO_STATE_SCHEMA, ARDUINO_STATE_SCHEMA, STATUS_SCHEMA)
+
+class MessageDecoder:
+    '''Turns one received line into a message.\n
+    Registered schemas are tried first, anything else goes to the JSON backend
+    (orjson when installed, json otherwise). Raises DecodeError on invalid JSON.\n
+    By default the schemas are only used with the json backend: bench_decoders.py shows
+    them beating json.loads but losing to orjson on every shape.'''
+    def __init__(self, schemas=None, loads=None):
+        if schemas is None:
+            schemas = () if loads is None and ACCELERATED else DEFAULT_SCHEMAS
+        self.schemas = list(schemas)
+        self.loads = loads or _loads
+        self.fast_hits = 0
+        self.fallbacks = 0
+
+    def register(self, schema):
+        self.schemas.append(schema)
+
+    def decode(self, data):
+        data = bytes(data)
+        for schema in self.schemas:
+            message = schema.match(data)
+            if message is not None:
+                self.fast_hits += 1
+                return message
+        self.fallbacks += 1
+        return self.loads(data)
+
+class SampleRingBuffer:
+    '''Bounded, thread safe buffer of (timestamp, sample) pairs.\n
+    Timestamps come from time.monotonic() at the moment the line was received.\n
+    Oldest samples are discarded once the capacity is reached.'''
+    def __init__(self, capacity=1024):
+        self._samples = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def push(self, timestamp, sample) -> bool:
+        '''Adds a sample. Returns True if the oldest sample had to be discarded.'''
+        with self._lock:
+            overflow = len(self._samples) == self._samples.maxlen
+            self._samples.append((timestamp, sample))
+        return overflow
+
+    def latest(self):
+        '''Returns the newest (timestamp, sample) pair or None if empty.'''
+        with self._lock:
+            if self._samples:
+                return self._samples[-1]
+        return None
+
+    def since(self, timestamp):
+        '''Returns every (timestamp, sample) pair received after the given timestamp, oldest first.'''
+        with self._lock:
+            result = []
+            # Walk backwards so only the new tail is visited
+            for entry in reversed(self._samples):
+                if entry[0] <= timestamp:
+                    break
+                result.append(entry)
+        result.reverse()
+        return result
+
+    def drain(self):
+        '''Removes and returns every buffered (timestamp, sample) pair, oldest first.'''
+        with self._lock:
+            result = list(self._samples)
+            self._samples.clear()
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def __len__(self):
+        return len(self._samples)
+
+class LinkMetrics:
+    '''Counters and histograms describing the health of one serial link.\n
+    Updated by the reader, read with snapshot() and cleared with reset().'''
+    MAX_OUTSTANDING = 64
+
+    def __init__(self):
+        self.round_trip = Histogram()
+        self.inter_arrival = Histogram()
+        self.write_time = Histogram()  # Duration of each write to the port
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.messages = 0
+        self.commands = 0
+        self.decode_failures = 0
+        self.partial_lines = 0
+        self.dropped_commands = 0  # Commands not sent because the port was disconnected
+        self.disconnects = 0
+        self.reconnects = 0
+        self.last_reconnect_time = None  # Seconds from losing the port to having it back
+        self.downtime = 0.0  # Total seconds spent disconnected, over completed reconnects
+        self.buffer_overflows = 0  # Partial lines dropped for exceeding MAX_LINE_LENGTH
+        self.dropped_samples = 0  # Samples evicted from the ring buffer before being drained
+        self.writes = 0  # Port writes, one per flush however many commands it carried
+        self.queue_depth = 0  # Commands waiting for the next flush
+        self.max_queue_depth = 0
+        self.jitter = 0.0
+        self.last_arrival = None
+        self.last_interval = None
+        # (request id or None, send time) of commands still waiting for a reply, oldest first
+        self.outstanding = deque(maxlen=self.MAX_OUTSTANDING)
+        self.round_trip.reset()
+        self.inter_arrival.reset()
+        self.write_time.reset()
+
+    def record_write(self, duration):
+        self.writes += 1
+        self.write_time.record(duration)
+
+    def record_reconnect(self, downtime):
+        self.reconnects += 1
+        self.last_reconnect_time = downtime
+        self.downtime += downtime
+
+    def record_message(self, timestamp, is_reply, request_id=None):
+        self.messages += 1
+        if self.last_arrival is not None:
+            interval = timestamp - self.last_arrival
+            self.inter_arrival.record(interval)
+            if self.last_interval is not None:
+                # Smoothed interval variation, same estimator as RFC 3550
+                self.jitter += (abs(interval - self.last_interval) - self.jitter) / 16
+            self.last_interval = interval
+        self.last_arrival = timestamp
+        if request_id is not None:
+            # Tagged replies can arrive between pushed samples and out of order, match them by id
+            for index, (sent_id, sent) in enumerate(self.outstanding):
+                if sent_id == request_id:
+                    del self.outstanding[index]
+                    self.round_trip.record(timestamp - sent)
+                    break
+        elif is_reply and self.outstanding:
+            self.round_trip.record(timestamp - self.outstanding.popleft()[1])
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed": elapsed,
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+            "rx_bytes_per_second": self.bytes_received / elapsed if elapsed > 0 else 0.0,
+            "tx_bytes_per_second": self.bytes_sent / elapsed if elapsed > 0 else 0.0,
+            "messages": self.messages,
+            "commands": self.commands,
+            "outstanding": len(self.outstanding),
+            "decode_failures": self.decode_failures,
+            "partial_lines": self.partial_lines,
+            "buffer_overflows": self.buffer_overflows,
+            "dropped_commands": self.dropped_commands,
+            "disconnects": self.disconnects,
+            "reconnects": self.reconnects,
+            "last_reconnect_time": self.last_reconnect_time,
+            "downtime": self.downtime,
+            "dropped_samples": self.dropped_samples,
+            "writes": self.writes,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "jitter": self.jitter,
+            "round_trip": self.round_trip.snapshot(),
+            "inter_arrival": self.inter_arrival.snapshot(),
+            "write_time": self.write_time.snapshot(),
+        }
+
+# Encoded commands without variable fields, e.g. {"command": "poll"}, by command name
+COMMAND_TEMPLATES = {}
+
+def encode_command(obj) -> bytes:
+    '''Encodes a command as one JSON line.\n
+    Bare commands and commands with only an id are built from a cached template.'''
+    name = obj.get("command")
+    if isinstance(name, str) and len(obj) <= 2 and (len(obj) == 1 or type(obj.get("id")) is int):
+        template = COMMAND_TEMPLATES.get(name)
+        if template is None:
+            bare = json.dumps({"command": name}).encode()
+            template = COMMAND_TEMPLATES[name] = (bare + b"\n", bare[:-1] + b', "id": ')
+        if len(obj) == 1:
+            return template[0]
+        return template[1] + str(obj["id"]).encode() + b"}\n"
+    return (json.dumps(obj) + '\n').encode()
+
+PICO_TICKS_PERIOD = 1 << 30  # MicroPython ticks_us wraps at 2^30
+ARDUINO_TICKS_PERIOD = 1 << 32  # micros() wraps at 2^32
+
+class ClockSync:
+    '''Maps a device microsecond tick counter to local time.monotonic().\n
+    Fed with NTP style exchanges: the local send and receive time of a "sync" command
+    and the device ticks in its reply. Offset and drift come from a least squares fit
+    over the exchanges with the lowest round trip times. Drift is only estimated once the
+    exchanges span min_span seconds, before that millisecond noise would swamp it.'''
+    def __init__(self, period=ARDUINO_TICKS_PERIOD, window=32, min_span=10.0):
+        self.period = period
+        self.min_span = min_span
+        self.exchanges = deque(maxlen=window)  # (device seconds, local midpoint, round trip)
+        self.last_ticks = None
+        self.device_time = 0.0
+        self.offset = None  # Local time at device time zero
+        self.drift = 1.0  # Local seconds per device second
+
+    @property
+    def synced(self) -> bool:
+        return self.offset is not None
+
+    def observe(self, ticks) -> float:
+        '''Unwraps a tick reading into device seconds. Must see readings in arrival order.'''
+        if self.last_ticks is None:
+            elapsed = ticks
+        else:
+            elapsed = (ticks - self.last_ticks) % self.period
+            # Readings slightly older than the last one are negative, not a full wrap
+            if elapsed > self.period // 2:
+                elapsed -= self.period
+        self.last_ticks = ticks
+        self.device_time += elapsed / 1e6
+        return self.device_time
+
+    def to_local(self, device_time):
+        '''Converts unwrapped device seconds to local monotonic time, None until synced.'''
+        if self.offset is None:
+            return None
+        return self.offset + self.drift * device_time
+
+    def add_exchange(self, sent, received, ticks):
+        device_time = self.observe(ticks)
+        self.exchanges.append((device_time, (sent + received) / 2, received - sent))
+        self._fit()
+
+    def _fit(self):
+        # Exchanges with queueing delay give biased midpoints, only keep the fastest half
+        best = sorted(self.exchanges, key=lambda exchange: exchange[2])[:max(2, len(self.exchanges) // 2)]
+        if len(best) < 2:
+            device_time, local_time, _ = best[0]
+            self.offset = local_time - self.drift * device_time
+            return
+        count = len(best)
+        mean_device = sum(exchange[0] for exchange in best) / count
+        mean_local = sum(exchange[1] for exchange in best) / count
+        spread = sum((exchange[0] - mean_device) ** 2 for exchange in best)
+        span = max(exchange[0] for exchange in best) - min(exchange[0] for exchange in best)
+        if span >= self.min_span and spread > 0:
+            self.drift = sum((exchange[0] - mean_device) * (exchange[1] - mean_local) for exchange in best) / spread
+        self.offset = mean_local - self.drift * mean_device
+
+    def snapshot(self) -> dict:
+        round_trips = [exchange[2] for exchange in self.exchanges]
+        return {
+            "synced": self.synced,
+            "exchanges": len(self.exchanges),
+            "offset": self.offset,
+            "drift_ppm": (self.drift - 1.0) * 1e6,
+            "best_round_trip": min(round_trips) if round_trips else None,
+        }
+
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
 
 class JSONSerialReader:
-    def __init__(self, port, baud=115200):
-        self.ser = serial.Serial(port, baud, timeout=0.1)  # Added small timeout
+    def __init__(self, port, baud=115200, threaded=False, buffer_size=1024, latest_only=False, capture=None,
+                 decoder=None, ticks_period=ARDUINO_TICKS_PERIOD, reconnect=False, coalesce=False):
+        self.port = port if isinstance(port, str) else None
+        self.baud = baud
+        # With reconnect a lost (or not yet present) port is reopened in the background
+        self.reconnect = reconnect and self.port is not None
+        self.connected = False
+        self.connection_lock = threading.Lock()
+        self.closing = threading.Event()
+        self.disconnected_at = None
+        # Callbacks receiving "connected" or "disconnected", called from whichever thread noticed
+        self.connection_listeners = []
+        # Commands replayed after every reconnect, keyed by command name, see add_init_command()
+        self.init_commands = {}
+        if self.port is None:
+            # Already open serial like object, e.g. capture.ReplaySource
+            self.ser = port
+            self.connected = True
+        else:
+            try:
+                self.ser = serial.Serial(port, baud, timeout=0.1)  # Added small timeout
+                self.connected = True
+            except serial.SerialException:
+                if not self.reconnect:
+                    raise
+                self.ser = None
         self.latest_json = None
-        # Clear any pending data
-        self.ser.reset_input_buffer()
-        self.ser.reset_output_buffer()
-        time.sleep(0.1)  # Allow time for buffer clearing
-        
-    def poll(self):
-        if self.ser.in_waiting:  # Check if data is available
-            data = self.ser.readline()
-            if data:
+        self.latest_time = None
+        self.samples = SampleRingBuffer(buffer_size)
+        self.running = False
+        self.reader_thread = None
+        # Binary framing is off until the device acknowledges request_binary()
+        self.binary = False
+        self.frames = FrameDecoder()
+        # Callbacks receiving (timestamp, message) for every parsed message
+        self.subscribers = []
+        self.stream_rate = 0  # Rate acknowledged by the device, 0 when not streaming
+        # Bytes received but not yet split into lines, reused between reads
+        self.rx_buffer = bytearray()
+        # When set only the newest complete line of each read is decoded
+        self.latest_only = latest_only
+        self.skipped_lines = 0
+        self.metrics = LinkMetrics()
+        self.decoder = decoder or MessageDecoder()
+        # Device clock mapping, see sync()
+        self.clock = ClockSync(ticks_period)
+        self.sync_sent = {}  # Sync id -> send time, for pings waiting for a reply
+        self.request_id = 0  # Last id handed out, shared by sync pings and PipelinedClient
+        self.send_lock = threading.Lock()  # Replies can trigger sends from the reader thread
+        # With coalesce send() only queues, everything queued goes out in one write on flush()
+        self.coalesce = coalesce
+        self.tx_buffer = bytearray()
+        self.tx_syncs = []  # Ids of sync pings in tx_buffer, their send time is taken at flush
+        self.tx_ids = []  # Request id (or None) of every command in tx_buffer, for round trip matching
+        self.tx_commands = 0
+        # Called when the first command is queued after a flush, e.g. to schedule one
+        self.flush_requested = None
+        self.latest_receive_time = None
+        self.capture = None
+        if capture:
+            self.start_capture(capture)
+        if self.connected:
+            # Clear any pending data
+            self.ser.reset_input_buffer()
+            self.ser.reset_output_buffer()
+            time.sleep(0.1)  # Allow time for buffer clearing
+        else:
+            print(f"{port} not available yet, retrying in the background")
+            self.disconnected_at = time.monotonic()
+            self._start_reconnect()
+
+        if threaded:
+            self.start()
+
+    def start(self):
+        '''Starts a dedicated thread that continuously drains the port into self.samples.\n
+        poll() becomes unnecessary while the thread is running.'''
+        if self.running:
+            return
+        self.running = True
+        self.reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self.reader_thread.start()
+
+    def stop(self):
+        '''Stops the reader thread if one is running.'''
+        self.running = False
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+            self.reader_thread = None
+
+    def close(self):
+        if self.connected:
+            self.flush()
+        self.closing.set()
+        self.stop()
+        self.stop_capture()
+        if self.ser is not None:
+            self.ser.close()
+
+    def add_init_command(self, obj):
+        '''Registers a command to replay after every reconnect, e.g. {"command": "tare"}.\n
+        A later command with the same name replaces the earlier one.'''
+        self.init_commands[obj.get("command")] = obj
+
+    def remove_init_command(self, name):
+        self.init_commands.pop(name, None)
+
+    def _disconnected(self, error):
+        '''Called when the port fails. Never blocks, reopening happens on a background thread.'''
+        with self.connection_lock:
+            if not self.connected:
+                return
+            self.connected = False
+        self.disconnected_at = time.monotonic()
+        self.metrics.disconnects += 1
+        print(f"Lost {self.port}: {error}")
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self._notify("disconnected")
+        if self.reconnect and not self.closing.is_set():
+            self._start_reconnect()
+
+    def _start_reconnect(self):
+        threading.Thread(target=self._reconnect_loop, daemon=True).start()
+
+    def _reconnect_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.closing.is_set():
+            try:
+                ser = serial.Serial(self.port, self.baud, timeout=0.1)
+                # Anything queued from before the drop is stale
+                ser.reset_input_buffer()
+                ser.reset_output_buffer()
+            except serial.SerialException:
+                # Exponential backoff, the wait ends early if the reader is closed
+                self.closing.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            self._reset_link_state()
+            self.ser = ser
+            with self.connection_lock:
+                self.connected = True
+            self.metrics.record_reconnect(time.monotonic() - self.disconnected_at)
+            print(f"Reconnected {self.port}")
+            self._notify("connected")
+            for command in list(self.init_commands.values()):
+                self.send(command)
+            return
+
+    def _reset_link_state(self):
+        # A reconnected device has usually rebooted: JSON mode, not streaming, new clock
+        self.rx_buffer.clear()
+        self.frames.reset()
+        self.binary = False
+        self.stream_rate = 0
+        self.sync_sent.clear()
+        self.clock = ClockSync(self.clock.period, self.clock.exchanges.maxlen, self.clock.min_span)
+
+    def _notify(self, state):
+        for callback in self.connection_listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"Error in connection listener: {e}")
+
+    def start_capture(self, path):
+        '''Records every raw chunk read from the port, see capture.py for the format.'''
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def feed(self, data, timestamp=None):
+        '''Processes raw bytes as if they had just been read from the port.\n
+        Used to replay captures with their original timestamps.'''
+        self._handle_bytes(data, time.monotonic() if timestamp is None else timestamp)
+
+    def _reader_loop(self):
+        while self.running:
+            if not self.connected:
+                # The reconnect thread brings the port back, nothing to read until then
+                time.sleep(0.05)
+                continue
+            try:
+                # Blocks for at most the port timeout so stop() is noticed quickly
+                data = self.ser.read(self.ser.in_waiting or 1)
+                if data:
+                    self._handle_bytes(data, time.monotonic())
+            except OSError as e:
+                if self.reconnect:
+                    self._disconnected(e)
+                else:
+                    print(f"Error reading: {e}")
+                    time.sleep(0.1)
+            except Exception as e:
+                if not self.connected:
+                    continue  # The port was closed under us by a disconnect noticed elsewhere
+                print(f"Error reading: {e}")
+                time.sleep(0.1)
+
+    def _handle_bytes(self, data, timestamp):
+        '''Splits a raw chunk into complete lines, carrying any partial line over to the next call.'''
+        self.metrics.bytes_received += len(data)
+        if self.capture is not None:
+            self.capture.write(timestamp, data)
+        if self.binary:
+            self._handle_frames(data, timestamp)
+        else:
+            self._handle_lines(data, timestamp)
+
+    def _handle_lines(self, data, timestamp):
+        buffer = self.rx_buffer
+        buffer += data
+        consumed = buffer.rfind(b"\n") + 1
+        if consumed < len(buffer):
+            # Chunk ended mid line, the tail is carried over
+            self.metrics.partial_lines += 1
+        if not consumed:
+            if len(buffer) > MAX_LINE_LENGTH:
+                buffer.clear()
+                self.metrics.buffer_overflows += 1
+            return
+        # Start of the newest complete line, the only one decoded in latest_only mode
+        newest = buffer.rfind(b"\n", 0, consumed - 1) + 1
+        remainder = None
+        with memoryview(buffer) as view:
+            start = 0
+            while start < consumed:
+                end = buffer.find(b"\n", start, consumed)
+                # Status replies are never skipped since they carry acknowledgements and protocol switches
+                if self.latest_only and start != newest and buffer.find(b'"status"', start, end) == -1:
+                    self.skipped_lines += 1
+                else:
+                    self._handle_line(view[start:end], timestamp)
+                start = end + 1
+                if self.binary:
+                    # Everything after the acknowledgement is framed
+                    remainder = bytes(view[start:])
+                    break
+        if remainder is not None:
+            buffer.clear()
+            self._handle_frames(remainder, timestamp)
+        else:
+            del buffer[:consumed]
+
+    def _handle_line(self, data, timestamp):
+        try:
+            message = self.decoder.decode(data)
+        except DecodeError:
+            self.metrics.decode_failures += 1
+            return
+        except Exception as e:
+            self.metrics.decode_failures += 1
+            print(f"Error reading: {e}")
+            return
+        self._handle_message(message, timestamp)
+
+    def _handle_frames(self, data, timestamp):
+        decoder = self.frames
+        while True:
+            rejected = decoder.crc_errors + decoder.malformed
+            # Stops at status frames, one of them may switch the link back to JSON
+            frames = decoder.feed(data, stop_type=FRAME_STATUS)
+            data = b""
+            self.metrics.decode_failures += decoder.crc_errors + decoder.malformed - rejected
+            for frame_type, seq, payload in frames:
                 try:
-                    self.latest_json = json.loads(data.decode().strip())
-                except json.JSONDecodeError:
-                    pass
+                    message = frame_to_message(frame_type, payload)
                 except Exception as e:
-                    print(f"Error reading: {e}")
+                    self.metrics.decode_failures += 1
+                    print(f"Error decoding frame: {e}")
+                    continue
+                self._handle_message(message, timestamp)
+            if not self.binary:
+                # Everything after the acknowledgement is lines
+                remainder = bytes(decoder.buffer)
+                decoder.reset()
+                if remainder:
+                    self._handle_lines(remainder, timestamp)
+                return
+            if not decoder.stopped:
+                return
+
+    def _handle_message(self, message, timestamp):
+        # Protocol switches are acknowledged in the old format, everything after is in the new one
+        status = message.get("status") if isinstance(message, Mapping) else None
+        # Without correlation ids a reply is the next message, except pushed samples while streaming
+        request_id = message.get("id") if isinstance(message, Mapping) else None
+        self.metrics.record_message(timestamp, status is not None or not self.stream_rate, request_id)
+        self.latest_receive_time = timestamp
+        if status is not None:
+            if status == "binary":
+                self.binary = True
+                self.frames.reset()
+            elif status == "json":
+                self.binary = False
+            elif status == "streaming":
+                self.stream_rate = message.get("rate", 0)
+            elif status == "stopped":
+                self.stream_rate = 0
+            elif status == "sync":
+                sent = self.sync_sent.pop(message.get("id"), None)
+                if sent is not None:
+                    self.clock.add_exchange(sent, timestamp, message["t"])
+        elif isinstance(message, Mapping) and message.get("t") is not None:
+            # Stamped sample, use the capture time on the device once the clocks are synced
+            capture_time = self.clock.to_local(self.clock.observe(message["t"]))
+            if capture_time is not None:
+                timestamp = capture_time
+        self.latest_json = message
+        self.latest_time = timestamp
+        if self.samples.push(timestamp, message):
+            self.metrics.dropped_samples += 1
+        for callback in self.subscribers:
+            try:
+                callback(timestamp, message)
+            except Exception as e:
+                print(f"Error in subscriber: {e}")
+
+    def poll(self):
+        if not self.connected:
+            return
+        try:
+            waiting = self.ser.in_waiting
+            if waiting:  # Check if data is available
+                # Drain everything queued so a backlog is cleared in a single call
+                data = self.ser.read(waiting)
+                if data:
+                    self._handle_bytes(data, time.monotonic())
+        except OSError as e:
+            if not self.reconnect:
+                raise
+            self._disconnected(e)
 
     def get_latest(self):
         return self.latest_json
 
-    def send(self, obj):
-        line = json.dumps(obj) + '\n'
-        self.ser.write(line.encode())
-        self.ser.flush()  # Make sure data is sent immediately
\ No newline at end of file
+    def get_sample_age(self):
+        '''Returns the seconds since the latest sample was taken (received, until the clocks are synced),
+        or None if nothing has arrived.'''
+        if self.latest_time is None:
+            return None
+        return time.monotonic() - self.latest_time
+
+    def subscribe(self, callback):
+        '''Registers callback(timestamp, message) to be called for every parsed message.\n
+        Callbacks run on the reader thread when threaded, so keep them short.'''
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def start_stream(self, rate=100):
+        '''Asks the device to push samples at rate Hz instead of waiting for poll commands.\n
+        Calling it again while streaming changes the rate.\n
+        Starts the reader thread since pushed samples must be drained continuously.'''
+        self.start()
+        self.add_init_command({"command": "stream", "rate": rate})
+        self.send({"command": "stream", "rate": rate})
+
+    def stop_stream(self):
+        '''Asks the device to stop pushing samples. The reader thread keeps running.'''
+        self.remove_init_command("stream")
+        self.send({"command": "stop"})
+
+    def request_sync(self, timeout=1.0) -> int:
+        '''Sends one clock sync ping, the reply is folded into self.clock when it arrives.\n
+        Returns the ping id, which stays in self.sync_sent until the reply is seen.
+        Pings older than timeout seconds are given up on, so lost ones do not pile up.'''
+        now = time.monotonic()
+        for ping, sent in list(self.sync_sent.items()):
+            if now - sent > timeout:
+                self.sync_sent.pop(ping, None)
+        ping = self.next_request_id()
+        self.send({"command": "sync", "id": ping})
+        if self.coalesce:
+            # The send time is only stamped at flush, and a queued ping would skew the round trip
+            self.flush()
+        return ping
+
+    def next_request_id(self) -> int:
+        '''Returns a fresh id for a command, the device echoes it in its reply.'''
+        self.request_id = (self.request_id + 1) & 0xFFFF
+        return self.request_id
+
+    def sync(self, count=8, timeout=0.2) -> bool:
+        '''Runs count sync exchanges one after another and returns whether the clock is synced.\n
+        Blocks the caller, polling the port itself unless the reader thread is running.'''
+        for _ in range(count):
+            ping = self.request_sync()
+            deadline = time.monotonic() + timeout
+            while ping in self.sync_sent and time.monotonic() < deadline:
+                if self.running:
+                    time.sleep(0.001)
+                else:
+                    self.poll()
+            # A lost ping must not linger, a very late reply would only skew the fit
+            self.sync_sent.pop(ping, None)
+        return self.clock.synced
+
+    def request_binary(self):
+        '''Asks the device to switch to COBS framed binary samples.\n
+        The reader switches over once the {"status": "binary"} acknowledgement arrives.'''
+        self.add_init_command({"command": "binary", "version": PROTOCOL_VERSION})
+        self.send({"command": "binary", "version": PROTOCOL_VERSION})
+
+    def request_json(self):
+        '''Asks the device to go back to newline delimited JSON, handy for debugging.'''
+        self.remove_init_command("binary")
+        self.send({"command": "json"})
+
+    def send(self, obj) -> bool:
+        '''Sends one command, or only queues it until flush() when coalescing.\n
+        Returns False if it was dropped because the port is down.'''
+        if not self.connected:
+            self.metrics.dropped_commands += 1
+            return False
+        line = encode_command(obj)
+        with self.send_lock:
+            first = not self.tx_commands
+            self.tx_buffer += line
+            self.tx_commands += 1
+            request_id = obj.get("id")
+            self.tx_ids.append(request_id)
+            if obj.get("command") == "sync":
+                self.tx_syncs.append(request_id)
+            metrics = self.metrics
+            metrics.bytes_sent += len(line)
+            metrics.queue_depth = self.tx_commands
+            if self.tx_commands > metrics.max_queue_depth:
+                metrics.max_queue_depth = self.tx_commands
+        if not self.coalesce:
+            return self.flush()
+        if first and self.flush_requested is not None:
+            self.flush_requested()
+        return True
+
+    def flush(self) -> bool:
+        '''Writes every queued command in a single write.\n
+        Does not wait for the bytes to leave the UART, the kernel drains them on its own.'''
+        with self.send_lock:
+            if not self.tx_commands:
+                return True
+            data = bytes(self.tx_buffer)
+            commands = self.tx_commands
+            syncs = self.tx_syncs
+            ids = self.tx_ids
+            self.tx_buffer.clear()
+            self.tx_commands = 0
+            self.tx_syncs = []
+            self.tx_ids = []
+            self.metrics.queue_depth = 0
+            sent = time.monotonic()
+            for ping in syncs:
+                self.sync_sent[ping] = sent
+            for request_id in ids:
+                self.metrics.commands += 1
+                self.metrics.outstanding.append((request_id, sent))
+            try:
+                self.ser.write(data)
+            except OSError as e:
+                if not self.reconnect:
+                    raise
+                self.metrics.dropped_commands += commands
+                failure = e
+            else:
+                self.metrics.record_write(time.monotonic() - sent)
+                return True
+        self._disconnected(failure)
+        return False
+
+class PendingRequest:
+    '''One command sent through a PipelinedClient.\n
+    reply holds the matching message once done is set, error is "timeout" if it never came.'''
+    __slots__ = ("id", "command", "callback", "sent", "deadline", "attempts", "reply", "error", "done")
+
+    def __init__(self, request_id, command, callback=None):
+        self.id = request_id
+        self.command = command
+        self.callback = callback
+        self.sent = None
+        self.deadline = None
+        self.attempts = 0
+        self.reply = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        '''Blocks until the request finishes and returns the reply (None on failure).\n
+        Only use this while the reader thread is running, otherwise nothing reads the port.'''
+        self.done.wait(timeout)
+        return self.reply
+
+class PipelinedClient:
+    '''Keeps up to depth id tagged commands in flight on one reader and matches replies by id.\n
+    A request that is not answered within timeout is resent, after retries resends it fails.\n
+    Call service() regularly (e.g. after every poll) so timeouts are noticed.'''
+    def __init__(self, reader, depth=4, timeout=0.2, retries=2):
+        self.reader = reader
+        self.depth = depth
+        self.timeout = timeout
+        self.retries = retries
+        self.in_flight = {}  # Request id -> PendingRequest
+        self.queued = deque()
+        self.lock = threading.Lock()
+        self.round_trip = Histogram()
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        reader.subscribe(self._on_message)
+
+    def submit(self, command, callback=None, **fields) -> PendingRequest:
+        '''Queues {"command": command, **fields} and sends it as soon as a slot is free.\n
+        callback(request) is called from whichever thread finishes the request.'''
+        request = PendingRequest(self.reader.next_request_id(), {"command": command, **fields}, callback)
+        with self.lock:
+            self.queued.append(request)
+        self._fill()
+        return request
+
+    def request(self, command, **fields):
+        '''Submits a command and blocks until it is answered or has failed every retry.\n
+        Polls the port itself unless the reader thread is running. Returns the reply or None.'''
+        request = self.submit(command, **fields)
+        while not request.done.is_set():
+            if self.reader.running:
+                request.done.wait(0.001)
+            else:
+                self.reader.poll()
+            self.service()
+        return request.reply
+
+    def service(self):
+        '''Resends or fails requests whose deadline has passed.'''
+        now = time.monotonic()
+        resend = []
+        expired = []
+        with self.lock:
+            for request in list(self.in_flight.values()):
+                if now < request.deadline:
+                    continue
+                if request.attempts > self.retries:
+                    del self.in_flight[request.id]
+                    expired.append(request)
+                else:
+                    resend.append(request)
+        if resend:
+            # Resent requests go out in a single write, see JSONSerialReader.flush()
+            for request in resend:
+                self.retried += 1
+                self._transmit(request)
+            self.reader.flush()
+        for request in expired:
+            self.failed += 1
+            self._finish(request, None, "timeout")
+        self._fill()
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": len(self.in_flight),
+            "queued": len(self.queued),
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "round_trip": self.round_trip.snapshot(),
+        }
+
+    def _fill(self):
+        sending = []
+        with self.lock:
+            while self.queued and len(self.in_flight) < self.depth:
+                request = self.queued.popleft()
+                self.in_flight[request.id] = request
+                sending.append(request)
+        for request in sending:
+            self._transmit(request)
+        if sending:
+            self.reader.flush()
+
+    def _transmit(self, request):
+        request.attempts += 1
+        request.sent = time.monotonic()
+        request.deadline = request.sent + self.timeout
+        self.reader.send({**request.command, "id": request.id})
+
+    def _finish(self, request, reply, error):
+        request.reply = reply
+        request.error = error
+        request.done.set()
+        if request.callback is not None:
+            try:
+                request.callback(request)
+            except Exception as e:
+                print(f"Error in request callback: {e}")
+
+    def _on_message(self, timestamp, message):
+        if not isinstance(message, Mapping) or message.get("id") is None:
+            return
+        with self.lock:
+            request = self.in_flight.pop(message.get("id"), None)
+        if request is None:
+            return  # Not ours (e.g. a sync ping) or a duplicate reply to a resent request
+        # Round trip uses the arrival time, timestamp may be the device capture time
+        self.round_trip.record(self.reader.latest_receive_time - request.sent)
+        self.completed += 1
+        self._finish(request, message, None)
+        self._fill()
@@ -1,13 +1,84 @@
-from jerial import JSONSerialReader
-import time
+from startup import profile, ENABLED as PROFILE_STARTUP
+from hub import SerialHub
+from bus import TelemetryWriter
+from timeseries import TelemetryStore
+from scheduler import Scheduler
+from jerial import PICO_TICKS_PERIOD, ARDUINO_TICKS_PERIOD
+import asyncio
+import signal
 
 '''
 TODO: Check to see if the usb ports on the Raspberry Pi are still not working with tty.
 '''
 
-pico = JSONSerialReader("/dev/pico")
-arduino = JSONSerialReader("/dev/arduino")
+PICO_STREAM_RATE = 500
+ARDUINO_POLL_RATE = 200
+REPORT_RATE = 0.1
+# Clock sync pings keep offset and drift tracked, see jerial.ClockSync
+SYNC_RATE = 0.5
+STARTUP_SYNC_COUNT = 8
+
+# Every microcontroller is served by one event loop, see hub.py
+hub = SerialHub()
+with profile.phase("open serial"):
+    pico = hub.add_device("pico", "/dev/pico", ticks_period=PICO_TICKS_PERIOD)
+    arduino = hub.add_device("arduino", "/dev/arduino", ticks_period=ARDUINO_TICKS_PERIOD)
+
+# Audio and UI processes read the fused state from shared memory, see bus.py
+telemetry = TelemetryWriter()
+hub.subscribe(telemetry.update)
+# History of every channel for windowed queries and plots
+history = TelemetryStore()
+hub.subscribe(history.on_message)
+
+# Periodic work shares the loop with the serial readers, see scheduler.py
+scheduler = Scheduler()
+# The Arduino only answers polls, the Pico streams on its own
+scheduler.add("arduino_poll", lambda: arduino.send({"command": "poll"}), ARDUINO_POLL_RATE)
+scheduler.add("serial_flush", hub.flush, 500)
+
+def ping_clocks():
+    # Replies are folded into each reader's clock as they arrive, nothing waits for them here
+    for reader in (pico, arduino):
+        if reader.connected:
+            reader.request_sync()
+
+scheduler.add("clock_sync", ping_clocks, SYNC_RATE)
+
+def report():
+    for name, task in scheduler.snapshot().items():
+        print(f"{name}: {task['achieved_rate']:.1f}/{task['rate']} Hz, {task['misses']} misses, "
+              f"{task['overruns']} overruns, p99 {task['exec_time']['p99']}")
+    for name, link in hub.metrics().items():
+        print(f"{name}: {link['messages']} messages, {link['decode_failures']} decode failures, "
+              f"{link['reconnects']} reconnects")
+
+scheduler.add("report", report, REPORT_RATE)
+
+async def run():
+    await hub.start()
+    # Offset from a burst of pings before streaming starts, drift is fitted by the clock_sync task
+    with profile.phase("clock sync"):
+        for name, reader in (("pico", pico), ("arduino", arduino)):
+            if reader.connected and not await hub.sync(name, STARTUP_SYNC_COUNT):
+                print(f"{name}: clock not synced, using receive times until it is")
+    if PROFILE_STARTUP:
+        profile.print_report("serial startup")
+    # Replayed by the reader whenever the Pico reconnects
+    pico.add_init_command({"command": "stream", "rate": PICO_STREAM_RATE})
+    pico.send({"command": "stream", "rate": PICO_STREAM_RATE})
+    try:
+        await scheduler.run()
+    finally:
+        hub.close()
+        telemetry.close()
 
 
 if __name__ == "__main__":
-    print("Booting up system.")
\ No newline at end of file
+    print("Booting up system.")
+    # The supervisor stops children with SIGTERM, shut down as cleanly as for Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
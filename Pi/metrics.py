@@ -0,0 +1,51 @@
+'''
+Dependency free statistics shared by the serial, audio and UI processes.
+'''
+from bisect import bisect_left
+
+class Histogram:
+    '''Fixed bucket histogram for durations in seconds.\n
+    Buckets are log spaced from 10us to 10s, anything outside lands in the end buckets.'''
+    BOUNDS = tuple(10 ** (exponent / 4) for exponent in range(-20, 5))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''Returns the upper bound of the bucket holding the given fraction of samples.'''
+        if not self.count:
+            return None
+        target = fraction * self.count
+        running = 0
+        for index, bucket in enumerate(self.counts):
+            running += bucket
+            if running >= target:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
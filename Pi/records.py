@@ -0,0 +1,34 @@
+'''
+Fixed shape message records, kept free of serial dependencies so the bus can use them.
+'''
+from collections.abc import Mapping
+
+class Record(Mapping):
+    '''Base for fixed shape messages decoded by a schema.\n
+    Reads like the dict json.loads would have produced, so consumers work with either.'''
+    __slots__ = ()
+    KEYS = ()  # Message keys in firmware order
+    ATTRIBUTES = {}  # Message key -> attribute name, for keys that are not identifiers
+    OPTIONAL = ("t", "id")  # Keys left out of the mapping while their value is None
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        value = getattr(self, self.ATTRIBUTES.get(key, key))
+        if value is None and key in self.OPTIONAL:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for key in self.KEYS:
+            if key not in self.OPTIONAL or getattr(self, key) is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        return {key: value.to_dict() if isinstance(value, Record) else value for key, value in self.items()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
@@ -2,19 +2,56 @@
 """
 F1 Dashboard Application with 3D Visualization
 Provides telemetry gauges and 3D car visualization.
+
+Headless: python runner.py --headless [--duration 60] renders offscreen without the
+3D view and prints frame and paint statistics, no display needed.
 """
+from startup import profile, ENABLED as PROFILE_STARTUP
+import argparse
+import json
+import shutil
+import signal
 import sys
+import tempfile
 import os
-from PySide6.QtWidgets import QApplication, QMessageBox
-from PySide6.QtCore import QSize, QSettings
-from ui.dashboard import F1Dashboard
+with profile.phase("imports"):
+    from PySide6.QtWidgets import QApplication, QMessageBox
+    from PySide6.QtCore import QSize, QSettings, QTimer
+    from ui.dashboard import F1Dashboard
+    from bus import TelemetryReader, DEFAULT_NAME
+
+def connect_telemetry(dashboard, name, retry=1000):
+    """Attaches the dashboard to the telemetry bus, retrying until the serial process has created it."""
+    try:
+        dashboard.attach_telemetry(TelemetryReader(name))
+        print(f"Reading telemetry from {name}")
+    except FileNotFoundError:
+        QTimer.singleShot(retry, lambda: connect_telemetry(dashboard, name, retry))
+
+def print_frame_stats(dashboard):
+    print(json.dumps(dashboard.frame_stats()))
+    dashboard.reset_frame_stats()
 
 def main():
     """Main function to initialize and run the application."""
-    app = QApplication(sys.argv)
-    app.setStyle('Fusion')  # Use Fusion style for a more modern look
-    app.setApplicationName("F1-OS")
-    app.setOrganizationName("F1-OS")
+    parser = argparse.ArgumentParser(description="F1-OS dashboard.")
+    parser.add_argument("--headless", action="store_true", help="Render offscreen, without the 3D view")
+    parser.add_argument("--duration", type=float, default=None, help="Quit after this many seconds")
+    parser.add_argument("--stats", type=float, default=None,
+                        help="Print frame statistics every this many seconds, 10 by default when headless")
+    parser.add_argument("--bus", default=DEFAULT_NAME, help="Telemetry bus name")
+    args, qt_args = parser.parse_known_args()
+    if args.headless:
+        # Must be set before the QApplication exists
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        if args.stats is None:
+            args.stats = 10.0
+
+    with profile.phase("Qt init"):
+        app = QApplication(sys.argv[:1] + qt_args)
+        app.setStyle('Fusion')  # Use Fusion style for a more modern look
+        app.setApplicationName("F1-OS")
+        app.setOrganizationName("F1-OS")
     
     # Set the path to the model
     model_path = "C:\\Users\\Kp101\\OneDrive\\Engineering\\GoKart\\test.fbx"
@@ -26,7 +63,9 @@ def main():
         print(f"3D Model path: {model_path}")
         print(f"Model exists: {model_exists}")
         
-        if not model_exists:
+        if not model_exists and args.headless:
+            model_path = None
+        elif not model_exists:
             msg = QMessageBox()
             msg.setIcon(QMessageBox.Warning)
             msg.setText(f"Model file not found: {model_path}")
@@ -37,9 +76,17 @@ def main():
             model_path = None
     
     # Load window settings with relative path
-    settings = QSettings("ui/dashboard_settings.ini", QSettings.IniFormat)
+    settings_path = "ui/dashboard_settings.ini"
+    settings_dir = None
+    if args.headless:
+        # Offscreen window sizes must not overwrite the real layout, the copy is removed on exit
+        settings_dir = tempfile.TemporaryDirectory()
+        settings_path = os.path.join(settings_dir.name, "dashboard_settings.ini")
+        shutil.copyfile("ui/dashboard_settings.ini", settings_path)
+    settings = QSettings(settings_path, QSettings.IniFormat)
     
-    dashboard = F1Dashboard(settings_file= settings, model_path=model_path)
+    with profile.phase("dashboard"):
+        dashboard = F1Dashboard(settings_file= settings, model_path=model_path)
     
     # Set size from settings if available, otherwise use default
     if settings.contains("window/size"):
@@ -72,9 +119,39 @@ def main():
     dashboard.resizeEvent = lambda event: (super(F1Dashboard, dashboard).resizeEvent(event), on_window_geometry_changed())
     dashboard.moveEvent = lambda event: (super(F1Dashboard, dashboard).moveEvent(event), on_window_geometry_changed())
     
+    def on_first_frame():
+        profile.mark("first frame")
+        if not args.headless:
+            # Only now, importing Qt3D holds the GIL and would hold up the gauges' first paint
+            dashboard.load_car_view()
+
+    dashboard.first_frame.connect(on_first_frame)
     dashboard.show()
+    connect_telemetry(dashboard, args.bus)
+    if args.stats:
+        stats_timer = QTimer(dashboard)
+        stats_timer.timeout.connect(lambda: print_frame_stats(dashboard))
+        stats_timer.start(int(args.stats * 1000))
+    if args.duration:
+        QTimer.singleShot(int(args.duration * 1000), app.quit)
+    if PROFILE_STARTUP:
+        app.aboutToQuit.connect(profile.print_report)
     
-    sys.exit(app.exec())
+    # The supervisor stops children with SIGTERM, quit the event loop so the cleanup below runs.
+    # Python only runs signal handlers between bytecodes, the timer wakes it up regularly for that.
+    signal.signal(signal.SIGTERM, lambda signum, frame: app.quit())
+    signal_timer = QTimer(dashboard)
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(200)
+
+    exit_code = app.exec()
+    if dashboard.telemetry is not None:
+        dashboard.telemetry.close()
+    if settings_dir is not None:
+        # Write out pending changes first, QSettings would recreate the file when it is destroyed
+        settings.sync()
+        settings_dir.cleanup()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
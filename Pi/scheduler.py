@@ -0,0 +1,132 @@
+'''
+Fixed rate task scheduler for the Pi runtime.
+
+Tasks are plain functions run on the asyncio loop at a declared rate. Deadlines are
+absolute (loop.time() is time.monotonic()), so a slow period does not push every later
+period back. A task that falls more than a period behind skips the periods it missed,
+like the firmware stream loop, instead of running in a burst to catch up.
+'''
+import asyncio
+import time
+from metrics import Histogram
+
+class PeriodicTask:
+    '''One registered function and its timing statistics.\n
+    lateness is how long after its deadline a run started, exec_time how long it took.'''
+    def __init__(self, name, callback, rate):
+        self.name = name
+        self.callback = callback
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.deadline = None
+        self.lateness = Histogram()
+        self.exec_time = Histogram()
+        self.reset()
+
+    def reset(self):
+        self.runs = 0
+        self.misses = 0  # Periods skipped because the task was a full period late
+        self.overruns = 0  # Runs that took longer than the period
+        self.errors = 0
+        self.started = time.monotonic()
+        self.lateness.reset()
+        self.exec_time.reset()
+
+    def run(self, now) -> float:
+        '''Runs the task if its deadline has passed and returns the time it finished.'''
+        late = now - self.deadline
+        self.lateness.record(late)
+        if late >= self.period:
+            skipped = int(late / self.period)
+            self.misses += skipped
+            self.deadline += skipped * self.period
+        self.deadline += self.period
+        try:
+            self.callback()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error in task {self.name}: {e}")
+        finished = time.monotonic()
+        elapsed = finished - now
+        self.exec_time.record(elapsed)
+        if elapsed > self.period:
+            self.overruns += 1
+        self.runs += 1
+        return finished
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "rate": self.rate,
+            "achieved_rate": self.runs / elapsed if elapsed > 0 else 0.0,
+            "runs": self.runs,
+            "misses": self.misses,
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "lateness": self.lateness.snapshot(),
+            "exec_time": self.exec_time.snapshot(),
+            # Share of one core spent in the task
+            "load": self.exec_time.total / elapsed if elapsed > 0 else 0.0,
+        }
+
+class Scheduler:
+    '''Runs registered PeriodicTasks on the asyncio loop.\n
+    Tasks due at the same time run in registration order, so register the most
+    latency sensitive ones first.'''
+    def __init__(self):
+        self.tasks = []
+        self.running = False
+
+    def add(self, name, callback, rate) -> PeriodicTask:
+        '''Registers callback() to run rate times per second.'''
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive: {rate}")
+        task = PeriodicTask(name, callback, rate)
+        if self.running:
+            task.deadline = time.monotonic()
+        self.tasks.append(task)
+        return task
+
+    def remove(self, name):
+        self.tasks = [task for task in self.tasks if task.name != name]
+
+    def __getitem__(self, name) -> PeriodicTask:
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
+
+    def step(self, now=None) -> float:
+        '''Runs every task that is due and returns the next deadline.'''
+        now = time.monotonic() if now is None else now
+        for task in self.tasks:
+            if task.deadline is None:
+                task.deadline = now
+            if now >= task.deadline:
+                now = task.run(now)
+        return min((task.deadline for task in self.tasks), default=now + 0.1)
+
+    async def run(self):
+        '''Serves the tasks until cancelled or stop() is called.'''
+        self.running = True
+        start = time.monotonic()
+        for task in self.tasks:
+            task.deadline = start
+            task.reset()
+        try:
+            while self.running:
+                deadline = self.step()
+                # Yield even when already late so serial readers get a turn
+                await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+        finally:
+            self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def snapshot(self) -> dict:
+        return {task.name: task.snapshot() for task in self.tasks}
+
+    def reset(self):
+        for task in self.tasks:
+            task.reset()
@@ -1,3 +1,4 @@
 sudo udevadm control --reload-rules
 sudo udevadm trigger
-sudo python main.py
\ No newline at end of file
+# Runs main.py, audio.py and runner.py as pinned, supervised processes
+sudo python supervisor.py
\ No newline at end of file
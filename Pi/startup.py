@@ -0,0 +1,63 @@
+'''
+Startup timing. Every process records how long its boot phases take (imports, Qt init,
+model load, audio decode) and when it reached milestones like the first frame or sound.
+
+Import this module first so its clock starts as early as possible. Set F1OS_PROFILE_STARTUP=1
+to have the timings printed, they are recorded either way and cost next to nothing.
+'''
+import os
+import time
+from contextlib import contextmanager
+
+ENABLED = os.environ.get("F1OS_PROFILE_STARTUP") == "1"
+
+def _process_age() -> float:
+    '''Seconds since the kernel started this process, so interpreter startup is counted too.'''
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        return max(0.0, time.clock_gettime(time.CLOCK_BOOTTIME) - started)
+    except (OSError, AttributeError, ValueError):
+        return 0.0
+
+class StartupProfile:
+    '''Phases and milestones of one process, in seconds since it was started.'''
+    def __init__(self):
+        self.origin = time.monotonic() - _process_age()
+        self.phases = []  # (name, start, duration) in the order they finished
+        self.marks = {}  # Milestone name -> time
+
+    def now(self) -> float:
+        return time.monotonic() - self.origin
+
+    @contextmanager
+    def phase(self, name):
+        '''Times the enclosed block, phases may nest.'''
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, self.now() - start))
+
+    def mark(self, name) -> None:
+        '''Records a milestone, only the first occurrence counts.'''
+        if name not in self.marks:
+            self.marks[name] = self.now()
+            if ENABLED:
+                print(f"[startup] {name} at {self.marks[name] * 1000:.0f} ms")
+
+    def report(self) -> dict:
+        return {
+            "phases": [{"name": name, "start": start, "duration": duration} for name, start, duration in self.phases],
+            "marks": dict(self.marks),
+        }
+
+    def print_report(self, title="startup") -> None:
+        print(f"[{title}] {self.now() * 1000:.0f} ms since process start")
+        for name, start, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            print(f"    {name:<24}{start * 1000:>8.0f} ms  +{duration * 1000:.0f} ms")
+        for name, at in sorted(self.marks.items(), key=lambda mark: mark[1]):
+            print(f"    {name:<24}{at * 1000:>8.0f} ms")
+
+# One profile per process
+profile = StartupProfile()
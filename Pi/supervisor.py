@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Starts the serial hub, the engine sound and the dashboard as separate processes.
+Each gets its own core so Qt repaints and garbage collection elsewhere cannot
+starve the audio callback, crashed children are restarted with a backoff.
+
+Run from the Pi directory: python supervisor.py [--only serial audio ...]
+Real time priority and locked memory need root or CAP_SYS_NICE / CAP_IPC_LOCK,
+without them the children still run, just with normal scheduling.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import signal
+import sys
+import time
+
+MIN_RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+STABLE_TIME = 60.0  # A child that ran this long gets its restart delay reset
+REPORT_INTERVAL = 30.0
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+class ChildSpec:
+    '''How to run one subsystem.\n
+    cpus is the set of cores it may use, realtime a SCHED_FIFO priority (1-99) or None.'''
+    def __init__(self, name, command, cpus=None, realtime=None):
+        self.name = name
+        self.command = command
+        self.cpus = cpus
+        self.realtime = realtime
+
+# Core 0 is left to the kernel, USB interrupts and this supervisor
+DEFAULT_CHILDREN = (
+    ChildSpec("serial", [sys.executable, "main.py"], cpus={1}),
+    ChildSpec("audio", [sys.executable, "audio.py", "--mlock"], cpus={2}, realtime=50),
+    ChildSpec("dashboard", [sys.executable, "runner.py"], cpus={3}),
+)
+
+def lock_memory(*arrays, limit=None) -> bool:
+    '''Locks the pages of the given numpy arrays into RAM so they are never paged out.\n
+    Meant for preloaded audio samples, returns False if the limit or permissions forbid it.
+    With limit (bytes) arrays are locked in the order given until the next one would not fit,
+    the rest are left to be paged in on demand.'''
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    locked = True
+    total = 0
+    for array in arrays:
+        if limit is not None and total + array.nbytes > limit:
+            continue
+        if libc.mlock(ctypes.c_void_p(array.ctypes.data), ctypes.c_size_t(array.nbytes)) != 0:
+            error = ctypes.get_errno()
+            print(f"Could not lock {array.nbytes} bytes of samples: {os.strerror(error)}")
+            locked = False
+        else:
+            total += array.nbytes
+    if limit is not None:
+        print(f"Locked {total / 1e6:.0f} MB of samples")
+    return locked
+
+def process_usage(pid) -> dict:
+    '''CPU seconds and memory of a running process from /proc, empty if it is gone.'''
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        cpus = os.sched_getaffinity(pid)
+    except OSError:
+        return {}
+    return {
+        "user_time": int(fields[11]) / CLOCK_TICKS,
+        "system_time": int(fields[12]) / CLOCK_TICKS,
+        "threads": int(fields[17]),
+        "rss": int(fields[21]) * PAGE_SIZE,
+        "locked": int(status.get("VmLck", "0 kB").split()[0]) * 1024,
+        "voluntary_switches": int(status.get("voluntary_ctxt_switches", "0")),
+        "involuntary_switches": int(status.get("nonvoluntary_ctxt_switches", "0")),
+        "cpu": cpus,
+    }
+
+class Child:
+    '''A running (or waiting to restart) subsystem process.'''
+    def __init__(self, spec):
+        self.spec = spec
+        self.pid = None
+        self.started = None
+        self.restarts = 0
+        self.restart_delay = MIN_RESTART_DELAY
+        self.restart_at = 0.0
+        self.last_exit = None
+        self.last_usage = None  # rusage of the last exited instance
+        self.sample = None  # (time, cpu seconds) of the previous report, for the CPU share
+
+    def start(self):
+        spec = self.spec
+        self.pid = os.posix_spawn(spec.command[0], spec.command, os.environ)
+        self.started = time.monotonic()
+        self.sample = None
+        print(f"Started {spec.name} (pid {self.pid}): {' '.join(spec.command)}")
+        if spec.cpus:
+            cpus = spec.cpus & os.sched_getaffinity(0)
+            if cpus:
+                os.sched_setaffinity(self.pid, cpus)
+            else:
+                print(f"{spec.name}: cores {sorted(spec.cpus)} not available, not pinning")
+        if spec.realtime is not None:
+            try:
+                os.sched_setscheduler(self.pid, os.SCHED_FIFO, os.sched_param(spec.realtime))
+            except PermissionError:
+                print(f"{spec.name}: no permission for SCHED_FIFO, running with normal priority")
+
+    def exited(self, status, usage):
+        '''Records an exit reported by wait4 and schedules the restart.'''
+        ran = time.monotonic() - self.started
+        self.pid = None
+        self.last_exit = os.waitstatus_to_exitcode(status)
+        self.last_usage = usage
+        if ran >= STABLE_TIME:
+            self.restart_delay = MIN_RESTART_DELAY
+        print(f"{self.spec.name} exited with {self.last_exit} after {ran:.1f}s "
+              f"({usage.ru_utime + usage.ru_stime:.1f}s CPU, {usage.ru_maxrss} kB max RSS), "
+              f"restarting in {self.restart_delay:.0f}s")
+        self.restart_at = time.monotonic() + self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def report(self) -> dict:
+        result = {"running": self.pid is not None, "restarts": self.restarts, "last_exit": self.last_exit}
+        if self.pid is None:
+            return result
+        usage = process_usage(self.pid)
+        if usage:
+            now = time.monotonic()
+            cpu = usage["user_time"] + usage["system_time"]
+            if self.sample is not None:
+                usage["cpu_share"] = (cpu - self.sample[1]) / (now - self.sample[0])
+            self.sample = (now, cpu)
+            result.update(usage)
+        return result
+
+class Supervisor:
+    def __init__(self, specs=DEFAULT_CHILDREN):
+        self.children = {spec.name: Child(spec) for spec in specs}
+        self.running = False
+
+    def run(self):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for child in self.children.values():
+            child.start()
+        next_report = time.monotonic() + REPORT_INTERVAL
+        try:
+            while self.running:
+                self._reap()
+                now = time.monotonic()
+                for child in self.children.values():
+                    if child.pid is None and now >= child.restart_at:
+                        child.restarts += 1
+                        child.start()
+                if now >= next_report:
+                    self.print_report()
+                    next_report = now + REPORT_INTERVAL
+                time.sleep(0.2)
+        finally:
+            self.shutdown()
+
+    def _reap(self):
+        for child in self.children.values():
+            if child.pid is None:
+                continue
+            pid, status, usage = os.wait4(child.pid, os.WNOHANG)
+            if pid:
+                child.exited(status, usage)
+
+    def _on_signal(self, signum, frame):
+        self.running = False
+
+    def shutdown(self, timeout=5.0):
+        '''Asks every child to stop, kills the ones still running after timeout.'''
+        running = [child for child in self.children.values() if child.pid is not None]
+        for child in running:
+            os.kill(child.pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        while running and time.monotonic() < deadline:
+            time.sleep(0.05)
+            for child in list(running):
+                if os.waitpid(child.pid, os.WNOHANG)[0]:
+                    child.pid = None
+                    running.remove(child)
+        for child in running:
+            print(f"{child.spec.name} did not stop, killing it")
+            os.kill(child.pid, signal.SIGKILL)
+            os.waitpid(child.pid, 0)
+            child.pid = None
+
+    def report(self) -> dict:
+        return {name: child.report() for name, child in self.children.items()}
+
+    def print_report(self):
+        for name, usage in self.report().items():
+            if not usage["running"]:
+                print(f"{name}: not running, {usage['restarts']} restarts, last exit {usage['last_exit']}")
+                continue
+            share = usage.get("cpu_share")
+            print(f"{name}: {f'{share * 100:.0f}%' if share is not None else '-'} CPU on {sorted(usage['cpu'])}, "
+                  f"{usage['rss'] / 1e6:.0f} MB RSS, {usage['locked'] / 1e6:.0f} MB locked, "
+                  f"{usage['involuntary_switches']} preemptions, {usage['restarts']} restarts")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the F1-OS subsystems as supervised processes.")
+    parser.add_argument("--only", nargs="*", choices=[spec.name for spec in DEFAULT_CHILDREN],
+                        help="Subsystems to run, all of them by default")
+    parser.add_argument("--headless", action="store_true", help="Render the dashboard offscreen")
+    parser.add_argument("--no-display", action="store_true",
+                        help="Audio only: skip the dashboard, e.g. when the screen is disconnected")
+    args = parser.parse_args()
+    specs = [spec for spec in DEFAULT_CHILDREN if not args.only or spec.name in args.only]
+    if args.no_display:
+        specs = [spec for spec in specs if spec.name != "dashboard"]
+    elif args.headless:
+        specs = [ChildSpec(spec.name, spec.command + ["--headless"], spec.cpus, spec.realtime)
+                 if spec.name == "dashboard" else spec for spec in specs]
+    Supervisor(specs).run()
+
+if __name__ == "__main__":
+    main()
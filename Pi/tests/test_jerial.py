@@ -0,0 +1,55 @@
+import json
+from framing import encode_frame, FRAME_STATUS, FRAME_PICO_STATE, PICO_STATE
+from jerial import JSONSerialReader
+
+class FakePort:
+    '''Just enough of serial.Serial for JSONSerialReader to be fed by hand.'''
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+def binary_reader():
+    reader = JSONSerialReader(FakePort())
+    reader.binary = True
+    return reader
+
+def test_json_switch_keeps_lines_from_the_same_read():
+    reader = binary_reader()
+    lines = [json.dumps({"throttle": float(i), "break": 0.0, "speed": 0.0}).encode() + b"\r\n" for i in range(8)]
+    chunk = encode_frame(FRAME_STATUS, 0, b'{"status": "json"}') + b"".join(lines)
+    reader.feed(chunk, 1.0)
+    assert not reader.binary
+    assert reader.metrics.messages == 9
+    assert reader.metrics.decode_failures == 0
+    assert reader.get_latest()["throttle"] == 7.0
+
+def test_json_switch_after_state_frames():
+    reader = binary_reader()
+    state = encode_frame(FRAME_PICO_STATE, 0, PICO_STATE.pack(1.5, True, 3, False, 100))
+    chunk = state + encode_frame(FRAME_STATUS, 1, b'{"status": "json"}') + b'{"status": "ok"}\r\n{"steer": 2'
+    reader.feed(chunk, 1.0)
+    assert reader.metrics.messages == 3
+    assert reader.get_latest() == {"status": "ok"}
+    # The partial line is carried over like any other
+    reader.feed(b'.5}\r\n', 2.0)
+    assert reader.get_latest()["steer"] == 2.5
+
+def test_sync_with_coalescing_and_no_hub():
+    from emulator import ArduinoEmulator
+    emulator = ArduinoEmulator()
+    emulator.start()
+    reader = JSONSerialReader(emulator.port, coalesce=True)
+    try:
+        assert reader.sync(count=4)
+        assert reader.clock.snapshot()["exchanges"] == 4
+    finally:
+        reader.close()
+        emulator.stop()
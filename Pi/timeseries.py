@@ -0,0 +1,228 @@
+'''
+Columnar in memory history of every telemetry channel.
+
+Each channel is a preallocated numpy ring of (time, value) with O(1) append, plus
+downsampled tiers holding min/max/mean per bucket so a plot of the last hour never
+touches more points than it can draw. Nothing is allocated per sample.
+'''
+import math
+import numpy as np
+from collections.abc import Mapping
+
+# Base capacity covers a minute at 1 kHz, tiers are (bucket seconds, buckets)
+DEFAULT_CAPACITY = 60000
+DEFAULT_TIERS = ((0.1, 6000), (1.0, 3600))
+SKIPPED_KEYS = ("t", "id", "status")
+ALIASES = {"break": "brake"}  # The Arduino spells it like that on the wire
+
+class RingBuffer:
+    '''Fixed capacity ring of timestamped rows, oldest rows are overwritten.\n
+    Queries rely on the times being sorted, so a time earlier than the newest one is stored
+    as the newest one. That happens when a device clock fit is refined or the link reconnects.'''
+    def __init__(self, capacity, columns=1, dtype=np.float64):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, columns), dtype=dtype)
+        self.count = 0  # Rows ever appended, the write index is count % capacity
+        self.last_time = -math.inf
+        self.clamped = 0  # Rows whose time went backwards and was raised to the newest time
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, row) -> float:
+        '''Stores a row and returns the time it was stored under.'''
+        if timestamp < self.last_time:
+            timestamp = self.last_time
+            self.clamped += 1
+        self.last_time = timestamp
+        index = self.count % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = row
+        self.count += 1
+        return timestamp
+
+    def clear(self) -> None:
+        self.count = 0
+        self.last_time = -math.inf
+
+    def latest(self):
+        '''Returns (time, row) of the newest entry, or None if empty.'''
+        if not self.count:
+            return None
+        index = (self.count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def _physical(self, start, stop):
+        '''Logical [start, stop) (0 = oldest kept row) as at most two physical slices.'''
+        if self.count <= self.capacity:
+            return (slice(start, stop),)
+        head = self.count % self.capacity
+        start, stop = (head + start) % self.capacity, (head + stop) % self.capacity or self.capacity
+        if start < stop:
+            return (slice(start, stop),)
+        return slice(start, self.capacity), slice(0, stop)
+
+    def _search(self, timestamp) -> int:
+        '''Logical index of the first row at or after timestamp.'''
+        size = len(self)
+        if self.count <= self.capacity:
+            return int(np.searchsorted(self.times[:size], timestamp, "left"))
+        head = self.count % self.capacity
+        older = self.times[head:]
+        if older.size and timestamp <= older[-1]:
+            return int(np.searchsorted(older, timestamp, "left"))
+        return older.size + int(np.searchsorted(self.times[:head], timestamp, "left"))
+
+    def _take(self, start, stop):
+        if start >= stop:
+            return self.times[:0].copy(), self.values[:0].copy()
+        parts = self._physical(start, stop)
+        if len(parts) == 1:
+            return self.times[parts[0]].copy(), self.values[parts[0]].copy()
+        return np.concatenate([self.times[p] for p in parts]), np.concatenate([self.values[p] for p in parts])
+
+    def last(self, n):
+        '''Returns (times, values) copies of the newest n rows, oldest first.'''
+        size = len(self)
+        return self._take(max(0, size - n), size)
+
+    def since(self, timestamp):
+        '''Returns (times, values) copies of every row at or after timestamp.'''
+        return self._take(self._search(timestamp), len(self))
+
+    def window(self, seconds, now=None):
+        '''Rows of the last seconds, measured back from now or from the newest row.'''
+        if now is None:
+            latest = self.latest()
+            if latest is None:
+                return self._take(0, 0)
+            now = latest[0]
+        return self.since(now - seconds)
+
+class Tier:
+    '''Downsampled copy of a channel: one (min, max, mean) row per bucket of resolution seconds.'''
+    MIN, MAX, MEAN = range(3)
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.ring = RingBuffer(capacity, 3)
+        self.bucket = None  # Index of the bucket being accumulated
+        self.low = math.inf
+        self.high = -math.inf
+        self.total = 0.0
+        self.samples = 0
+
+    def add(self, timestamp, value) -> None:
+        bucket = math.floor(timestamp / self.resolution)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        if value < self.low:
+            self.low = value
+        if value > self.high:
+            self.high = value
+        self.total += value
+        self.samples += 1
+
+    def flush(self) -> None:
+        '''Closes the current bucket, stamped with its start time.'''
+        if self.samples:
+            self.ring.append(self.bucket * self.resolution, (self.low, self.high, self.total / self.samples))
+        self.low = math.inf
+        self.high = -math.inf
+        self.total = 0.0
+        self.samples = 0
+
+    def window(self, seconds, now=None):
+        return self.ring.window(seconds, now)
+
+class Channel:
+    '''Full resolution history of one value plus its downsampled tiers.'''
+    def __init__(self, name, capacity=DEFAULT_CAPACITY, tiers=DEFAULT_TIERS):
+        self.name = name
+        self.ring = RingBuffer(capacity)
+        self.tiers = [Tier(resolution, size) for resolution, size in tiers]
+
+    def __len__(self):
+        return len(self.ring)
+
+    def append(self, timestamp, value) -> None:
+        # Tiers get the clamped time too, their buckets must only move forwards
+        timestamp = self.ring.append(timestamp, value)
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+    def latest(self):
+        latest = self.ring.latest()
+        return None if latest is None else (latest[0], latest[1][0])
+
+    def window(self, seconds, now=None):
+        '''Returns (times, values) 1-D arrays of the last seconds at full resolution.'''
+        times, values = self.ring.window(seconds, now)
+        return times, values[:, 0]
+
+    def last(self, n):
+        times, values = self.ring.last(n)
+        return times, values[:, 0]
+
+    def stats(self, seconds, now=None) -> dict:
+        '''min/max/mean/count over the last seconds, NaN when there is nothing in the window.'''
+        _, values = self.window(seconds, now)
+        if not values.size:
+            return {"min": math.nan, "max": math.nan, "mean": math.nan, "count": 0}
+        return {"min": float(values.min()), "max": float(values.max()), "mean": float(values.mean()),
+                "count": int(values.size)}
+
+    def plot(self, seconds, max_points=1000, now=None):
+        '''Returns (times, min, max, mean) for the last seconds with at most about max_points rows.\n
+        Uses the finest resolution that fits, full resolution rows have min == max == mean.'''
+        if now is None:
+            latest = self.latest()
+            now = latest[0] if latest else 0.0
+        # Count before copying, a long window at full resolution is mostly thrown away
+        if len(self.ring) - self.ring._search(now - seconds) <= max_points:
+            times, values = self.ring.since(now - seconds)
+            column = values[:, 0]
+            return times, column, column, column
+        for tier in self.tiers:
+            if seconds / tier.resolution <= max_points or tier is self.tiers[-1]:
+                times, rows = tier.window(seconds, now)
+                return times, rows[:, Tier.MIN], rows[:, Tier.MAX], rows[:, Tier.MEAN]
+
+class TelemetryStore:
+    '''History of every numeric field that arrives from the devices.\n
+    Channels are created on first sight, nested fields are flattened with an underscore
+    (knob.count becomes knob_count). Feed it with SerialHub.subscribe(store.on_message).'''
+    def __init__(self, capacity=DEFAULT_CAPACITY, tiers=DEFAULT_TIERS):
+        self.capacity = capacity
+        self.tiers = tiers
+        self.channels = {}
+
+    def __getitem__(self, name) -> Channel:
+        return self.channels[name]
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def channel(self, name) -> Channel:
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = Channel(name, self.capacity, self.tiers)
+        return channel
+
+    def record(self, timestamp, message, prefix="") -> None:
+        '''Appends every numeric field of message. Status replies are ignored.'''
+        if "status" in message:
+            return
+        for key, value in message.items():
+            if key in SKIPPED_KEYS:
+                continue
+            name = prefix + ALIASES.get(key, key)
+            if isinstance(value, Mapping):
+                self.record(timestamp, value, name + "_")
+            elif isinstance(value, (int, float)):
+                self.channel(name).append(timestamp, value)
+
+    def on_message(self, name, timestamp, message) -> None:
+        self.record(timestamp, message)
@@ -5,6 +5,7 @@ from PySide6.Qt3DCore import Qt3DCore
 from PySide6.Qt3DExtras import Qt3DExtras
 from PySide6.Qt3DRender import Qt3DRender
 from PySide6.Qt3DInput import Qt3DInput
+from startup import profile
 import os
 
 class Car3DWidget(QWidget):
@@ -220,6 +221,7 @@ class Car3DWidget(QWidget):
         """Handle mesh loading status changes."""
         if status == Qt3DRender.QMesh.Ready:
             print("STL mesh loaded successfully")
+            profile.mark("model loaded")
             self.model_loaded = True
             self.focus_on_model()
         elif status == Qt3DRender.QMesh.Error:
@@ -229,6 +231,7 @@ class Car3DWidget(QWidget):
         """Handle scene loading status changes."""
         if status == Qt3DRender.QSceneLoader.Ready:
             print("FBX/OBJ scene loaded successfully")
+            profile.mark("model loaded")
             self.model_loaded = True
             QTimer.singleShot(500, self.focus_on_model)  # Additional delay for complex models
         elif status == Qt3DRender.QSceneLoader.Error:
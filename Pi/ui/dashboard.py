@@ -2,17 +2,46 @@ from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, 
     QHBoxLayout, QLabel, QFrame, QSizePolicy, QSplitter
 )
-from PySide6.QtCore import Qt, QSettings, QSize
+from PySide6.QtCore import Qt, QSettings, QSize, Signal, QTimer, QEvent
 from ui.gauge import GaugeWidget
-from ui.car3d import Car3DWidget
+from startup import profile
+from metrics import Histogram
+import importlib
+import threading
+import time
 import os
 
+# RPM range covered by the engine recordings, see engine/audio/timestamps.json
+IDLE_RPM = 4000
+MAX_RPM = 18000
+
 class F1Dashboard(QMainWindow):
     """Main dashboard window that displays gauges and car visualization."""
+
+    # Emitted from the import thread, delivered on the GUI thread
+    car_view_imported = Signal()
+    # Emitted once, after the paint pass that first drew the gauges
+    first_frame = Signal()
     
     def __init__(self, settings_file : QSettings, title="F1 Dash", model_path=None):
-        """Initialize the dashboard with all widgets and layouts."""
+        """Initialize the dashboard with all widgets and layouts.
+
+        The 3D car view is created later by load_car_view(), Qt3D takes seconds to import on the Pi.
+        Call it once the first frame is up, the import holds the GIL for most of that time.
+        """
         super().__init__()
+        self.model_path = model_path
+        self.car_widget = None
+        self.car_view_imported.connect(self._create_car_view)
+        # Telemetry updates, see attach_telemetry()
+        self.telemetry = None
+        self.telemetry_timer = None
+        self.frames = 0  # Updates that brought new data
+        self.idle_ticks = 0  # Updates where nothing had changed
+        self.frame_interval = Histogram()
+        self.update_time = Histogram()
+        self.last_frame = None
+        self.stats_started = time.monotonic()
         
         self.setWindowTitle(title)
         self.setMinimumSize(800, 600)
@@ -46,15 +75,18 @@ class F1Dashboard(QMainWindow):
         self.mph_gauge.setMinimumWidth(150)
         self.mph_gauge.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
         
-        # 3D Car visualization
-        self.car_widget = Car3DWidget(model_path)
-        self.car_widget.setMinimumWidth(300)
-        self.car_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        # Placeholder holding the splitter slot until the 3D car view is loaded
+        self.car_placeholder = QLabel("Loading 3D view...")
+        self.car_placeholder.setStyleSheet("background-color: #232323; color: #555; border-radius: 5px;")
+        self.car_placeholder.setAlignment(Qt.AlignCenter)
+        self.car_placeholder.setMinimumWidth(300)
+        self.car_placeholder.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         
         # Add widgets to splitter
         self.main_splitter.addWidget(self.rpm_gauge)
-        self.main_splitter.addWidget(self.car_widget)
+        self.main_splitter.addWidget(self.car_placeholder)
         self.main_splitter.addWidget(self.mph_gauge)
+        self.rpm_gauge.installEventFilter(self)
         
         # Load saved splitter sizes if available
         self.load_splitter_settings()
@@ -73,6 +105,88 @@ class F1Dashboard(QMainWindow):
         telemetry_layout.addWidget(telemetry_label)
         
         main_layout.addWidget(self.telemetry_frame)
+
+    def eventFilter(self, watched, event):
+        if watched is self.rpm_gauge and event.type() == QEvent.Paint:
+            self.rpm_gauge.removeEventFilter(self)
+            # Queued, so it runs once the whole window has been painted and flushed
+            QTimer.singleShot(0, self.first_frame.emit)
+        return super().eventFilter(watched, event)
+
+    def attach_telemetry(self, reader, rate=60):
+        """Drives the gauges from a bus.TelemetryReader, polled rate times per second."""
+        self.telemetry = reader
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.setTimerType(Qt.PreciseTimer)
+        self.telemetry_timer.timeout.connect(self.update_from_telemetry)
+        self.telemetry_timer.start(int(1000 / rate))
+
+    def update_from_telemetry(self):
+        """Copies the newest telemetry into the gauges, skipped when nothing was published."""
+        if not self.telemetry.changed():
+            self.idle_ticks += 1
+            return
+        started = time.monotonic()
+        state = self.telemetry.read()
+        self.setRPM((IDLE_RPM + state.throttle_fraction * (MAX_RPM - IDLE_RPM)) / 1000)
+        self.setSpeed(state.speed)
+        if self.car_widget is not None:
+            self.car_widget.setWheelAngle(state.steer)
+        finished = time.monotonic()
+        self.update_time.record(finished - started)
+        if self.last_frame is not None:
+            self.frame_interval.record(started - self.last_frame)
+        self.last_frame = started
+        self.frames += 1
+
+    def frame_stats(self) -> dict:
+        """Update rate and paint cost of the dashboard since the last reset."""
+        elapsed = time.monotonic() - self.stats_started
+        gauges = {"rpm": self.rpm_gauge, "mph": self.mph_gauge}
+        return {
+            "frames": self.frames,
+            "fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "idle_ticks": self.idle_ticks,
+            "frame_interval": self.frame_interval.snapshot(),
+            "update_time": self.update_time.snapshot(),
+            "paints": {name: gauge.paints for name, gauge in gauges.items()},
+            "paint_time": {name: gauge.paint_time.snapshot() for name, gauge in gauges.items()},
+        }
+
+    def reset_frame_stats(self):
+        self.frames = 0
+        self.idle_ticks = 0
+        self.frame_interval.reset()
+        self.update_time.reset()
+        self.last_frame = None
+        self.stats_started = time.monotonic()
+        for gauge in (self.rpm_gauge, self.mph_gauge):
+            gauge.paints = 0
+            gauge.paint_time.reset()
+
+    def load_car_view(self):
+        """Imports Qt3D on a background thread, the view replaces the placeholder once it is ready."""
+        if self.car_widget is not None:
+            return
+        threading.Thread(target=self._import_car_view, daemon=True).start()
+
+    def _import_car_view(self):
+        # Only the import happens here, widgets must be created on the GUI thread
+        with profile.phase("import 3D"):
+            importlib.import_module("ui.car3d")
+        self.car_view_imported.emit()
+
+    def _create_car_view(self):
+        from ui.car3d import Car3DWidget
+        with profile.phase("create 3D view"):
+            sizes = self.main_splitter.sizes()
+            self.car_widget = Car3DWidget(self.model_path)
+            self.car_widget.setMinimumWidth(300)
+            self.car_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+            self.main_splitter.replaceWidget(1, self.car_widget)
+            self.main_splitter.setSizes(sizes)
+            self.car_placeholder.deleteLater()
+        profile.mark("3D view")
     
     def setRPM(self, rpm):
         """Set the RPM gauge value."""
@@ -1,4 +1,6 @@
 import math
+import time
+from metrics import Histogram
 from PySide6.QtWidgets import QWidget
 from PySide6.QtGui import (
     QPainter, QPen, QBrush, QColor
@@ -17,10 +19,16 @@ class GaugeWidget(QWidget):
         self.max_value = max_value
         self.current_value = 0
         self.setMinimumSize(150, 150)
+        # Paint statistics, see F1Dashboard.frame_stats()
+        self.paints = 0
+        self.paint_time = Histogram()
     
     def setValue(self, value):
         """Set the current value of the gauge."""
-        self.current_value = max(0, min(self.max_value, value))
+        value = max(0, min(self.max_value, value))
+        if value == self.current_value:
+            return  # Nothing would change on screen, skip the repaint
+        self.current_value = value
         self.update()
     
     def getValue(self):
@@ -39,7 +47,13 @@ class GaugeWidget(QWidget):
         self.update()
     
     def paintEvent(self, event):
-        """Render the gauge on screen."""
+        """Render the gauge on screen and time it."""
+        started = time.perf_counter()
+        self._draw(event)
+        self.paint_time.record(time.perf_counter() - started)
+        self.paints += 1
+
+    def _draw(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
         
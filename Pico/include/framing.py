@@ -0,0 +1,74 @@
+from micropython import const
+import struct
+import json
+
+# Keep in sync with Pi/framing.py
+PROTOCOL_VERSION = const(2)
+FRAME_PICO_STATE = const(0x01)
+FRAME_STATUS = const(0x7F)
+FRAME_REPLY = const(0x40)  # Flag on a state frame type: payload starts with the u16 request id
+PICO_STATE_FORMAT = "<fBiBI"  # steer, button, knob count, knob switch, ticks_us
+
+def crc16(data) -> int:
+    '''CRC-16/CCITT-FALSE over the given bytes.'''
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+def cobs_encode(data) -> bytearray:
+    '''Encodes data so it contains no zero bytes.\n
+    Frames are small so a single pass without 254 byte splitting is enough.'''
+    out = bytearray(len(data) + 2)
+    code_index = 0
+    code = 1
+    index = 1
+    for byte in data:
+        if byte == 0:
+            out[code_index] = code
+            code_index = index
+            code = 1
+        else:
+            out[index] = byte
+            code += 1
+        index += 1
+    out[code_index] = code
+    return out[:index]
+
+class FrameWriter:
+    def __init__(self, stream):
+        '''Writes COBS framed packets to the given binary stream.\n
+        Requires a stream with a write function, e.g. sys.stdout.buffer.'''
+        self.stream = stream
+        self.seq = 0
+
+    def write(self, frame_type : int, payload) -> None:
+        '''Writes a single frame with the next sequence number.'''
+        raw = bytearray(2 + len(payload) + 2)
+        raw[0] = frame_type
+        raw[1] = self.seq
+        raw[2:2 + len(payload)] = payload
+        crc = crc16(raw[:-2])
+        raw[-2] = crc & 0xFF
+        raw[-1] = crc >> 8
+        self.stream.write(cobs_encode(raw))
+        self.stream.write(b"\x00")
+        self.seq = (self.seq + 1) & 0xFF
+
+    def write_pico_state(self, steer : float, button : bool, count : int, switch : bool, ticks : int, request_id = None) -> None:
+        '''Writes a sensor state frame stamped with the given ticks_us.\n
+        Pass the id of the command being answered to send it as a reply frame.'''
+        payload = struct.pack(PICO_STATE_FORMAT, steer, button, count, switch, ticks)
+        if request_id is None:
+            self.write(FRAME_PICO_STATE, payload)
+        else:
+            self.write(FRAME_PICO_STATE | FRAME_REPLY, struct.pack("<H", request_id) + payload)
+
+    def write_status(self, message : dict) -> None:
+        '''Writes a JSON status message inside a frame.'''
+        self.write(FRAME_STATUS, json.dumps(message).encode())
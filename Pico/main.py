@@ -3,6 +3,7 @@ from machine import Pin, reset, UART
 import include.gyro as gyro_module
 import include.button as button
 import include.knob as knob
+import include.framing as framing
 import json
 import os
 import time  # For delays
@@ -17,7 +18,14 @@ gyro = gyro_module.Gyro(16, 17)
 b1 = button.Button(26)
 k = knob.Knob(19, 18, 20)  # dt, clk, sw
 poller = select.poll()
+frames = framing.FrameWriter(sys.stdout.buffer)
+binary_mode = False  # Set by the "binary" command, samples are sent as COBS frames
 last_led_toggle = 0
+# Streaming state, set by the "stream" command
+MIN_STREAM_RATE = 1
+MAX_STREAM_RATE = 1000
+stream_period_us = 0  # 0 = streaming off, samples only sent on "poll"
+next_stream_us = 0
 
 # Setting attributes
 gyro.set_function_mode(gyro_module.NDOF_MODE)
@@ -62,34 +70,93 @@ def read() -> dict:
             pass
     return {}
 
+def respond(message: dict, request_id = None) -> None:
+    """Send a status message in the currently negotiated format.\n
+    The id of the command being answered is echoed so the Pi can match replies."""
+    if request_id is not None:
+        message["id"] = request_id
+    if binary_mode:
+        frames.write_status(message)
+    else:
+        print(json.dumps(message))
+
+def send_state(request_id = None) -> None:
+    """Send the current sensor state in the currently negotiated format.\n
+    Pushed samples have no id, poll replies echo the id of the command."""
+    if binary_mode:
+        frames.write_pico_state(gyro.get_angles()[0], b1.get_state(), k.get_count(), k.get_switch(), time.ticks_us(), request_id)
+        return
+    # Create state object
+    state = {
+        'steer': gyro.get_angles()[0],
+        'button': b1.get_state(),
+        'knob': {
+            "count": k.get_count(),
+            "switch": k.get_switch()
+        },
+        't': time.ticks_us()  # Capture time, mapped to Pi time by jerial.ClockSync
+    }
+    if request_id is not None:
+        state['id'] = request_id
+    # Send response as JSON
+    print(json.dumps(state))
+
+def start_stream(rate) -> int:
+    """Start (or retime) pushing samples at the given rate in Hz.\n
+    Returns the rate actually used after clamping."""
+    global stream_period_us, next_stream_us
+    rate = max(MIN_STREAM_RATE, min(MAX_STREAM_RATE, int(rate)))
+    stream_period_us = 1000000 // rate
+    next_stream_us = time.ticks_us()
+    return rate
+
+def stop_stream() -> None:
+    """Stop pushing samples, poll still works"""
+    global stream_period_us
+    stream_period_us = 0
+
 def process_command(command: dict) -> None:
     """Process the command received from stdin"""
+    global binary_mode
+    # Optional request id, echoed in the reply so several requests can be in flight
+    request_id = command.get("id")
     if command.get("command") == "reset":
-        print(json.dumps({'status': 'resetting'}))
+        respond({'status': 'resetting'}, request_id)
         reset()
     elif command.get("command") == "poll":
-        # Create state object
-        state = {
-            'steer': gyro.get_angles()[0],
-            'button': b1.get_state(),
-            'knob': {
-                "count": k.get_count(),
-                "switch": k.get_switch()
-            }
-        }   
-        # Send response as JSON
-        print(json.dumps(state))   
+        send_state(request_id)
+    elif command.get("command") == "sync":
+        # Clock sync ping, answered straight away so the round trip stays short
+        respond({"status": "sync", "t": time.ticks_us()}, request_id)
+    elif command.get("command") == "stream":
+        # Starts streaming, or changes the rate if already streaming
+        rate = start_stream(command.get("rate", 100))
+        respond({"status": "streaming", "rate": rate}, request_id)
+    elif command.get("command") == "stop":
+        stop_stream()
+        respond({"status": "stopped"}, request_id)
     elif command.get("command") == "save":
         save_angles()
-        print(json.dumps({"status": "saved"}))
+        respond({"status": "saved"}, request_id)
     elif command.get("command") == "tare":
         gyro.tare_gyro((0,0,0))
-        print(json.dumps({"status": "tared"}))
+        respond({"status": "tared"}, request_id)
+    elif command.get("command") == "binary":
+        # Acknowledge in JSON, everything after this is framed
+        reply = {"status": "binary", "version": framing.PROTOCOL_VERSION}
+        if request_id is not None:
+            reply["id"] = request_id
+        print(json.dumps(reply))
+        binary_mode = True
+    elif command.get("command") == "json":
+        # Acknowledge inside a frame, everything after this is JSON again
+        respond({"status": "json"}, request_id)
+        binary_mode = False
     else:
-        print(json.dumps({"status": "unknown command"}))
+        respond({"status": "unknown command"}, request_id)
 
 def loop():
-    global last_led_toggle
+    global last_led_toggle, next_stream_us
     # Update LED at 2Hz for visual heartbeat
     current_time = time.time_ns()/1000000  # Convert to milliseconds
     if current_time-last_led_toggle > 500:
@@ -100,6 +167,14 @@ def loop():
     gyro.poll()
     b1.poll()
     k.poll()
+
+    # Push a sample when the stream deadline has passed
+    if stream_period_us and time.ticks_diff(time.ticks_us(), next_stream_us) >= 0:
+        send_state()
+        next_stream_us = time.ticks_add(next_stream_us, stream_period_us)
+        # Skip missed deadlines instead of bursting to catch up
+        if time.ticks_diff(time.ticks_us(), next_stream_us) > 0:
+            next_stream_us = time.ticks_add(time.ticks_us(), stream_period_us)
     
     data = read()
     if not data == None and not data.get("command") == None: